@@ -0,0 +1,781 @@
+"""
+Transcriber - Fast MusicXML I/O
+Streams a MusicXML file into the lightweight per-staff measure data that
+BrassArranger consumes, without building a full music21 Score, and writes
+exported parts so they can be shared between several output files.
+"""
+
+import contextlib
+import copy
+import functools
+import hashlib
+import mmap
+import os
+import posixpath
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from dataclasses import dataclass, field
+
+import numpy as np
+from music21 import bar, common, duration, key, meter, note, pitch, chord, spanner, stream
+from music21.musicxml import helpers, m21ToXml
+
+# Prefer libxml2 for parsing when lxml is installed; the stdlib parser is the
+# C-accelerated expat fallback. Entities and DTDs are never resolved.
+try:
+    from lxml import etree as _parser_etree
+    _ITERPARSE_OPTIONS = {
+        'huge_tree': False,
+        'resolve_entities': False,
+        'remove_blank_text': True,
+        'remove_comments': True,
+        'remove_pis': True,
+    }
+except ImportError:
+    _parser_etree = ET
+    _ITERPARSE_OPTIONS = {}
+
+
+# Structured array layouts for the notes and rests of a single measure.
+# ``ps`` is the MIDI pitch and ``acc`` the chromatic alteration, so the
+# natural note (and therefore the spelling) is always ``ps - acc``.
+NOTE_DTYPE = np.dtype([('offset', 'f4'), ('ps', 'i2'), ('ql', 'f4'), ('acc', 'i1')])
+REST_DTYPE = np.dtype([('offset', 'f4'), ('ql', 'f4')])
+
+STEP_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+STEP_NAMES = {semitones: step for step, semitones in STEP_SEMITONES.items()}
+
+# Bump whenever parse_parts output changes so stale disk caches are ignored
+_CACHE_VERSION = 5
+
+# Flattened measure attributes used by the on-disk cache
+_MEASURE_DTYPE = np.dtype([
+    ('part', 'i4'), ('number', 'i4'), ('number_suffix', 'U16'), ('beats', 'i4'),
+    ('beat_type', 'i4'), ('key_sig', 'i1'), ('has_key', '?'), ('barline', 'U32'),
+    ('repeat', 'U8'), ('repeat_times', 'i4'), ('left_barline', 'U32'), ('left_repeat', 'U8'),
+    ('ending', 'U16'), ('ending_stop', '?'), ('implicit', '?'), ('padding_left', 'f4'),
+    ('padding_right', 'f4')
+])
+
+
+@dataclass
+class FastMeasure:
+    """Notes, rests and attribute changes of one measure on one staff."""
+    number: int
+    number_suffix: str = None  # Trailing text of the number, e.g. 'a' for measure '4a'
+    time_sig: tuple = None  # (beats, beat_type) when the meter is set here
+    key_sig: int = None     # Sharps (negative for flats) when the key is set here
+    notes: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=NOTE_DTYPE))
+    rests: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=REST_DTYPE))
+    barline: str = None     # Right barline style, e.g. 'light-heavy'
+    repeat: str = None      # Repeat sign on the right barline: 'end' (backward) or 'start'
+    repeat_times: int = None
+    left_barline: str = None  # Left barline style, kept only for repeats and styled barlines
+    left_repeat: str = None   # Repeat sign on the left barline, usually 'start' (forward)
+    ending: str = None      # Number(s) of the ending (volta bracket) that starts here
+    ending_stop: bool = False  # An ending closes at this measure
+    implicit: bool = False  # Not counted in the measure numbering, e.g. a pickup
+    padding_left: float = 0.0   # Quarter lengths missing before the content (pickup)
+    padding_right: float = 0.0  # Quarter lengths missing after the content (short bar)
+    suppress: np.ndarray = None  # Per note: accidental implied by the key (arranged parts)
+    inferred: np.ndarray = None  # Per note: spelling guessed from the pitch (audio input), or None
+
+
+@dataclass
+class FastPart:
+    """A single staff of a score as a list of measures."""
+    measures: list = field(default_factory=list)
+
+    def first_key_signature(self):
+        """Return the first key signature (in sharps) set in this part, or None."""
+        for measure in self.measures:
+            if measure.key_sig is not None:
+                return measure.key_sig
+        return None
+
+
+def make_pitch(ps, acc, inferred=False):
+    """Build a music21 Pitch from a MIDI pitch and its alteration.
+
+    With ``inferred`` the spelling is marked as a guess, as for ``Pitch(midi=...)``,
+    so music21 respells it when the pitch is transposed.
+    """
+    natural = int(ps) - int(acc)
+    new_pitch = pitch.Pitch(
+        step=STEP_NAMES[natural % 12],
+        octave=natural // 12 - 1,
+        accidental=int(acc) if acc else None
+    )
+    new_pitch.spellingIsInferred = inferred
+    return new_pitch
+
+
+@functools.lru_cache(maxsize=None)
+def _duration_components(quarter_length):
+    """Split a quarter length into music21's (immutable) duration components, or None for tuplets."""
+    template = duration.Duration(quarter_length)
+    if template.tuplets:
+        return None
+    return tuple(template.components)
+
+
+def make_duration(quarter_length):
+    """Build a music21 Duration, reusing the component split of lengths seen before."""
+    components = _duration_components(quarter_length)
+    if components is None:
+        return duration.Duration(quarter_length)  # Tuplets are mutable, so never shared
+    return duration.Duration(components=components)
+
+
+def _local_name(tag):
+    """Strip any XML namespace from a tag name."""
+    return tag.rpartition('}')[2]
+
+
+def _measure_number(value, last_number):
+    """Split a measure number attribute into (number, suffix) the way music21 does.
+
+    ``last_number`` is the number of the measure before, or None for the first
+    measure. A missing number continues the count, and Finale's unnumbered
+    'X1', 'X2', ... measures keep the previous number with the label as suffix.
+    """
+    digits, suffix = common.getNumFromStr(value or '')
+    number = int(digits) if digits else (last_number or 0) + 1
+    if last_number is not None and suffix == 'X' and number != last_number + 1:
+        return last_number, suffix + str(number)
+    return number, suffix or None
+
+
+def _ending_number(ending_el):
+    """Number(s) of an <ending>; like music21, a plain '2.' label overrides the attribute."""
+    label = re.match(r'^(\d+)\.?$', (ending_el.text or '').strip())
+    if label:
+        return label.group(1)
+    return ending_el.get('number') or '1'
+
+
+def _read_barline(barline_el, barlines):
+    """Record the style, repeat sign and ending marks of a <barline> as FastMeasure fields."""
+    location = barline_el.get('location', 'right')
+    style = barline_el.findtext('bar-style')
+    repeat_el = barline_el.find('repeat')
+    repeat = None
+    if repeat_el is not None:
+        repeat = 'start' if repeat_el.get('direction') == 'forward' else 'end'
+
+    if location == 'right':
+        # A repeat without an explicit style keeps music21's default look for its direction
+        barlines['barline'] = style or (None if repeat else 'regular')
+        barlines['repeat'] = repeat
+        if repeat_el is not None and repeat_el.get('times'):
+            barlines['repeat_times'] = int(repeat_el.get('times'))
+    elif location == 'left' and (style or repeat):
+        barlines['left_barline'] = style
+        barlines['left_repeat'] = repeat
+
+    ending_el = barline_el.find('ending')
+    if ending_el is not None:
+        if ending_el.get('type') == 'start':
+            barlines['ending'] = _ending_number(ending_el)
+        elif ending_el.get('type') in ('stop', 'discontinue'):
+            barlines['ending_stop'] = True
+
+
+class _PartReader:
+    """Accumulates the measures of one MusicXML <part>, split by staff."""
+
+    def __init__(self):
+        self.divisions = 1.0
+        self.staves = 1
+        self.bar_length = 4.0  # Quarter lengths in a full bar of the current meter
+        self.last_was_short = False
+        self.measures = []  # One {staff: FastMeasure} dict per measure
+
+    def read_measure(self, measure_el):
+        """Convert a fully parsed <measure> element into per-staff data."""
+        last_number = next(iter(self.measures[-1].values())).number if self.measures else None
+        number, number_suffix = _measure_number(measure_el.get('number'), last_number)
+        time_sigs = {}
+        key_sigs = {}
+        notes = {}
+        rests = {}
+        skips = {}  # <forward> rests of the kept voice not yet followed by a note
+        voices = {}
+        barlines = {}
+        position = 0.0  # In divisions
+        end = 0.0       # Furthest position reached by a note, in divisions
+
+        for child in measure_el:
+            tag = _local_name(child.tag)
+            if tag == 'attributes':
+                self._read_attributes(child, time_sigs, key_sigs)
+            elif tag == 'backup':
+                position -= float(child.findtext('duration', '0'))
+            elif tag == 'forward':
+                # A skip in the kept voice is silence; keep it as a rest so later notes keep their offsets
+                duration = float(child.findtext('duration', '0'))
+                staff = int(child.findtext('staff', '1'))
+                voice = child.findtext('voice', '1')
+                self.staves = max(self.staves, staff)
+                if duration > 0 and voices.setdefault(staff, voice) == voice:
+                    skips.setdefault(staff, []).append(
+                        (position / self.divisions, duration / self.divisions)
+                    )
+                position += duration
+            elif tag == 'note':
+                # Grace notes take no time; later chord members are dropped, so a chord
+                # plays as its first written note, as in _read_chord
+                if child.find('grace') is not None or child.find('chord') is not None:
+                    continue
+                duration = float(child.findtext('duration', '0'))
+                staff = int(child.findtext('staff', '1'))
+                voice = child.findtext('voice', '1')
+                self.staves = max(self.staves, staff)
+
+                # Brass parts are monophonic: keep the first voice on each staff
+                if voices.setdefault(staff, voice) == voice:
+                    rests.setdefault(staff, []).extend(skips.pop(staff, ()))
+                    offset = position / self.divisions
+                    quarter_length = duration / self.divisions
+                    pitch_el = child.find('pitch')
+                    if pitch_el is not None:
+                        acc = int(round(float(pitch_el.findtext('alter', '0'))))
+                        ps = (STEP_SEMITONES[pitch_el.findtext('step')]
+                              + 12 * (int(pitch_el.findtext('octave')) + 1) + acc)
+                        notes.setdefault(staff, []).append((offset, ps, quarter_length, acc))
+                    else:
+                        rests.setdefault(staff, []).append((offset, quarter_length))
+                position += duration
+                end = max(end, position)
+            elif tag == 'barline':
+                _read_barline(child, barlines)
+
+        # Skips closing a staff's notes only pad an incomplete bar, as music21 reads them;
+        # a staff holding nothing but skips is silent for their length
+        for staff, staff_skips in skips.items():
+            if staff not in notes and staff not in rests:
+                rests[staff] = staff_skips
+                end = max(end, max(offset + length for offset, length in staff_skips) * self.divisions)
+
+        time_sig = time_sigs.get(1, time_sigs.get(None))
+        if time_sig is not None:
+            self.bar_length = time_sig[0] * 4.0 / time_sig[1]
+        implicit = measure_el.get('implicit') == 'yes'
+        padding = self._padding(end / self.divisions, implicit)
+
+        self.measures.append({
+            staff: FastMeasure(
+                number=number,
+                number_suffix=number_suffix,
+                time_sig=time_sigs.get(staff, time_sigs.get(None)),
+                key_sig=key_sigs.get(staff, key_sigs.get(None)),
+                notes=np.array(notes.get(staff, []), dtype=NOTE_DTYPE),
+                rests=np.array(rests.get(staff, []), dtype=REST_DTYPE),
+                implicit=implicit,
+                **padding,
+                **barlines
+            )
+            for staff in range(1, self.staves + 1)
+        })
+
+    def _padding(self, length, implicit):
+        """Padding of a measure whose content fills ``length`` quarters, as music21 reads it.
+
+        A short first measure, one marked implicit or one right after a short
+        measure is a pickup; any other short measure is cut off at the end.
+        """
+        if not 0 < length < self.bar_length:
+            self.last_was_short = False
+            return {}
+        missing = self.bar_length - length
+        if not self.measures or implicit or self.last_was_short:
+            self.last_was_short = False
+            return {'padding_left': missing}
+        self.last_was_short = True
+        return {'padding_right': missing}
+
+    def _read_attributes(self, attributes_el, time_sigs, key_sigs):
+        """Read divisions, staves, key and time changes from <attributes>."""
+        for child in attributes_el:
+            tag = _local_name(child.tag)
+            if tag == 'divisions':
+                self.divisions = float(child.text)
+            elif tag == 'staves':
+                self.staves = int(child.text)
+            elif tag == 'key':
+                fifths = child.findtext('fifths')
+                if fifths is not None:
+                    staff = child.get('number')
+                    key_sigs[int(staff) if staff else None] = int(fifths)
+            elif tag == 'time':
+                beats = child.findtext('beats')
+                beat_type = child.findtext('beat-type')
+                if beats is not None and beat_type is not None:
+                    staff = child.get('number')
+                    # Additive meters such as 3+2/8 are reduced to their total
+                    time_sigs[int(staff) if staff else None] = (
+                        sum(int(b) for b in beats.split('+')), int(beat_type)
+                    )
+
+    def finish(self):
+        """Return one FastPart per staff."""
+        parts = [FastPart() for _ in range(self.staves)]
+        for measure_by_staff in self.measures:
+            first = next(iter(measure_by_staff.values()))
+            for staff, part in enumerate(parts, start=1):
+                part.measures.append(
+                    measure_by_staff.get(staff)
+                    or FastMeasure(number=first.number, number_suffix=first.number_suffix)
+                )
+        return parts
+
+
+def _mxl_root_file(archive):
+    """Name of the score inside a compressed .mxl archive."""
+    try:
+        container = ET.fromstring(archive.read('META-INF/container.xml'))
+        for el in container.iter():
+            if _local_name(el.tag) == 'rootfile' and el.get('full-path'):
+                return el.get('full-path')
+    except (KeyError, ET.ParseError):
+        pass  # No usable container; fall back to the first score-like entry
+
+    for name in archive.namelist():
+        if not name.startswith('META-INF/') and posixpath.splitext(name)[1] in ('.xml', '.musicxml'):
+            return name
+    raise ValueError('No MusicXML score found in compressed archive')
+
+
+@contextlib.contextmanager
+def _open_score(path):
+    """Open a MusicXML file for streaming, decompressing .mxl archives on the fly.
+
+    The file is memory-mapped so the parser reads straight from the page cache.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield f  # Empty files cannot be mapped
+            return
+
+        with mm:
+            if mm[:4] == b'PK\x03\x04':
+                # Compressed MusicXML: stream the root score out of the zip
+                with zipfile.ZipFile(f) as archive:
+                    with archive.open(_mxl_root_file(archive)) as score:
+                        yield score
+            else:
+                yield mm
+
+
+def parse_parts(path):
+    """Stream a partwise MusicXML (or .mxl) file into a list of FastParts (one per staff)."""
+    with _open_score(path) as source:
+        return _parse_source(source)
+
+
+def _parse_source(source):
+    """Stream a partwise MusicXML document from a file-like object."""
+    parts = []
+    reader = None
+
+    for event, el in _parser_etree.iterparse(source, events=('start', 'end'), **_ITERPARSE_OPTIONS):
+        tag = _local_name(el.tag)
+        if event == 'start':
+            if tag == 'part':
+                reader = _PartReader()
+            continue
+
+        if tag == 'measure' and reader is not None:
+            reader.read_measure(el)
+            el.clear()  # Free the parsed measure immediately
+        elif tag == 'part' and reader is not None:
+            parts.extend(reader.finish())
+            reader = None
+            el.clear()
+
+    return parts
+
+
+# Environment variable that overrides the cache directory
+CACHE_DIR_ENV = 'AI_MUSIC_TRANSCRIPTION_CACHE'
+
+_LEGACY_CACHE_NAME = re.compile(r'[0-9a-f]{40}\.npz')
+
+
+def default_cache_dir():
+    """Return the directory used to cache parsed MusicXML files.
+
+    ``$AI_MUSIC_TRANSCRIPTION_CACHE`` takes precedence over the XDG cache directory.
+    """
+    override = os.environ.get(CACHE_DIR_ENV)
+    if override:
+        return override
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ai-music-transcription')
+
+
+def _cache_file(path, cache_dir):
+    """Cache file for a MusicXML file, named '<path key>-<mtime, size and version key>.npz'."""
+    stat = os.stat(path)
+    source_key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:20]
+    stamp = repr((stat.st_mtime_ns, stat.st_size, _CACHE_VERSION))
+    stamp_key = hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:20]
+    return os.path.join(cache_dir, '%s-%s.npz' % (source_key, stamp_key))
+
+
+def _prune_stale_entries(cache_file):
+    """Remove cache entries for the same source file from older versions of it or of the format."""
+    cache_dir, name = os.path.split(cache_file)
+    prefix = name.partition('-')[0] + '-'
+    with os.scandir(cache_dir) as entries:
+        # Entries named by a single hash predate the per-source naming and can never be hit
+        stale = [entry.path for entry in entries
+                 if (entry.name.startswith(prefix) and entry.name != name)
+                 or _LEGACY_CACHE_NAME.fullmatch(entry.name)]
+    for stale_file in stale:
+        with contextlib.suppress(OSError):
+            os.remove(stale_file)
+
+
+def _parts_to_arrays(parts):
+    """Flatten FastParts into measure, note and rest arrays for np.savez."""
+    measures = []
+    notes = []
+    rests = []
+    for part_index, part in enumerate(parts):
+        for measure in part.measures:
+            beats, beat_type = measure.time_sig or (0, 0)
+            measures.append((
+                part_index, measure.number, measure.number_suffix or '', beats, beat_type,
+                measure.key_sig or 0, measure.key_sig is not None, measure.barline or '',
+                measure.repeat or '', measure.repeat_times or 0, measure.left_barline or '',
+                measure.left_repeat or '', measure.ending or '', measure.ending_stop,
+                measure.implicit, measure.padding_left, measure.padding_right
+            ))
+            notes.append(measure.notes)
+            rests.append(measure.rests)
+
+    return {
+        'measures': np.array(measures, dtype=_MEASURE_DTYPE),
+        'note_counts': np.array([len(n) for n in notes], dtype=np.int64),
+        'notes': np.concatenate(notes) if notes else np.empty(0, dtype=NOTE_DTYPE),
+        'rest_counts': np.array([len(r) for r in rests], dtype=np.int64),
+        'rests': np.concatenate(rests) if rests else np.empty(0, dtype=REST_DTYPE),
+    }
+
+
+def _parts_from_arrays(arrays):
+    """Rebuild FastParts from the arrays written by _parts_to_arrays."""
+    measures = arrays['measures']
+    notes = np.split(arrays['notes'], np.cumsum(arrays['note_counts'])[:-1])
+    rests = np.split(arrays['rests'], np.cumsum(arrays['rest_counts'])[:-1])
+
+    parts = [FastPart() for _ in range(int(measures['part'].max()) + 1 if len(measures) else 0)]
+    for index, row in enumerate(measures):
+        parts[row['part']].measures.append(FastMeasure(
+            number=int(row['number']),
+            number_suffix=str(row['number_suffix']) or None,
+            time_sig=(int(row['beats']), int(row['beat_type'])) if row['beats'] else None,
+            key_sig=int(row['key_sig']) if row['has_key'] else None,
+            notes=notes[index],
+            rests=rests[index],
+            barline=str(row['barline']) or None,
+            repeat=str(row['repeat']) or None,
+            repeat_times=int(row['repeat_times']) or None,
+            left_barline=str(row['left_barline']) or None,
+            left_repeat=str(row['left_repeat']) or None,
+            ending=str(row['ending']) or None,
+            ending_stop=bool(row['ending_stop']),
+            implicit=bool(row['implicit']),
+            padding_left=float(row['padding_left']),
+            padding_right=float(row['padding_right'])
+        ))
+    return parts
+
+
+def parse_parts_cached(path, cache_dir=None):
+    """Like parse_parts, but reuse an on-disk copy of the arrays when the file is unchanged.
+
+    ``cache_dir`` defaults to default_cache_dir(). Writing a new entry removes the
+    stale ones left for the same file.
+    """
+    cache_file = _cache_file(path, cache_dir or default_cache_dir())
+
+    try:
+        with np.load(cache_file, allow_pickle=False) as data:
+            return _parts_from_arrays(data)
+    except (OSError, KeyError, ValueError):
+        pass  # Missing or unreadable cache entry
+
+    parts = parse_parts(path)
+
+    # Caching is best effort; write atomically so concurrent runs never see partial files
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_file), suffix='.npz',
+                                         delete=False) as f:
+            np.savez(f, **_parts_to_arrays(parts))
+        os.replace(f.name, cache_file)
+        _prune_stale_entries(cache_file)
+    except OSError:
+        pass
+
+    return parts
+
+
+def _classify_elements(stream_obj, classes):
+    """Bucket the direct elements of a music21 stream by class in a single pass."""
+    buckets = {cls: [] for cls in classes}
+    for element in stream_obj.elements:
+        for cls in classes:
+            if isinstance(element, cls):
+                buckets[cls].append(element)
+                break
+    return buckets
+
+
+def _read_note(element, notes, rests, inferred, offset=None, quarter_length=None):
+    """Record a note; chords pass their own offset and length for their first note."""
+    offset = float(element.offset) if offset is None else offset
+    quarter_length = float(element.quarterLength) if quarter_length is None else quarter_length
+    acc = int(round(element.pitch.alter))
+    ps = int(round(element.pitch.ps - element.pitch.alter)) + acc
+    notes.append((offset, ps, quarter_length, acc))
+    inferred.append(element.pitch.spellingIsInferred)
+
+
+def _read_chord(element, notes, rests, inferred):
+    """Record a chord as its first note (brass parts are monophonic)."""
+    _read_note(element.notes[0], notes, rests, inferred,
+               float(element.offset), float(element.quarterLength))
+
+
+def _read_rest(element, notes, rests, inferred):
+    """Record a rest, or any other unpitched element, as silence."""
+    rests.append((float(element.offset), float(element.quarterLength)))
+
+
+# Exact element type -> reader; other GeneralNote subclasses resolve by inheritance once
+_ELEMENT_HANDLERS = {
+    note.Note: _read_note,
+    note.Rest: _read_rest,
+    chord.Chord: _read_chord,
+}
+
+
+def _element_handler(element_type):
+    """Return the reader for an element type, caching subclass lookups."""
+    handler = _ELEMENT_HANDLERS.get(element_type)
+    if handler is None:
+        if issubclass(element_type, chord.Chord):
+            handler = _read_chord
+        elif issubclass(element_type, note.Note):
+            handler = _read_note
+        else:
+            handler = _read_rest
+        _ELEMENT_HANDLERS[element_type] = handler
+    return handler
+
+
+def _stream_barline(barline):
+    """(style, repeat direction, repeat times) of a music21 barline, or Nones."""
+    if barline is None:
+        return None, None, None
+    if isinstance(barline, bar.Repeat):
+        return barline.type, barline.direction, barline.times
+    return barline.type, None, None
+
+
+def part_from_stream(part):
+    """Convert a music21 Part into a FastPart."""
+    fast_part = FastPart()
+    part_elements = _classify_elements(part, (key.KeySignature, stream.Measure))
+    part_keys = part_elements[key.KeySignature]
+
+    # Endings are spanners over the part's measures: note where each starts and stops
+    ending_starts = {}
+    ending_stops = set()
+    for bracket in part.spannerBundle.getByClass(spanner.RepeatBracket):
+        spanned = bracket.getSpannedElements()
+        if spanned:
+            ending_starts[id(spanned[0])] = str(bracket.number or '1')
+            ending_stops.add(id(spanned[-1]))
+
+    for index, measure in enumerate(part_elements[stream.Measure]):
+        measure_elements = _classify_elements(
+            measure, (key.KeySignature, meter.TimeSignature, note.GeneralNote)
+        )
+        key_sigs = measure_elements[key.KeySignature] or (part_keys if index == 0 else [])
+        time_sigs = measure_elements[meter.TimeSignature]
+
+        notes = []
+        rests = []
+        inferred = []
+        for element in measure_elements[note.GeneralNote]:
+            _element_handler(type(element))(element, notes, rests, inferred)
+
+        barline, repeat, repeat_times = _stream_barline(measure.rightBarline)
+        left_barline, left_repeat, _ = _stream_barline(measure.leftBarline)
+        if left_repeat is None and left_barline == 'regular':
+            left_barline = None  # Plain left barlines only carry endings, kept separately
+
+        fast_part.measures.append(FastMeasure(
+            number=measure.number,
+            number_suffix=measure.numberSuffix,
+            time_sig=(time_sigs[0].numerator, time_sigs[0].denominator) if time_sigs else None,
+            key_sig=key_sigs[0].sharps if key_sigs else None,
+            notes=np.array(notes, dtype=NOTE_DTYPE),
+            rests=np.array(rests, dtype=REST_DTYPE),
+            barline=barline,
+            repeat=repeat,
+            repeat_times=repeat_times,
+            left_barline=left_barline,
+            left_repeat=left_repeat,
+            ending=ending_starts.get(id(measure)),
+            ending_stop=id(measure) in ending_stops,
+            implicit=measure.showNumber is stream.enums.ShowNumber.NEVER,
+            padding_left=float(measure.paddingLeft),
+            padding_right=float(measure.paddingRight),
+            inferred=np.array(inferred, dtype=np.bool_) if any(inferred) else None
+        ))
+
+    return fast_part
+
+
+def parts_from_score(score):
+    """Convert every part of a music21 Score into FastParts."""
+    return [part_from_stream(part) for part in score.parts]
+
+
+class ExportedScore:
+    """A music21 Score exported to MusicXML once, with each part serialized separately."""
+
+    def __init__(self, score, in_place=False):
+        """Run music21's exporter on the score and serialize its parts.
+
+        With ``in_place`` the notation fix-ups (rests, ties, beams) are applied to
+        ``score`` itself instead of to a deep copy; use it for throwaway scores.
+        """
+        if in_place:
+            # The same preparation GeneralObjectExporter does, minus its copy
+            score.makeRests(refStreamOrTimeRange=[0.0, score.highestTime], fillGaps=True,
+                            inPlace=True, hideRests=True, timeRangeFromBarDuration=True)
+            score.makeNotation(inPlace=True)
+            exporter = m21ToXml.ScoreExporter(score, makeNotation=True)
+        else:
+            general_exporter = m21ToXml.GeneralObjectExporter(score)
+            exporter = m21ToXml.ScoreExporter(
+                general_exporter.fromGeneralObject(score),
+                makeNotation=general_exporter.makeNotation
+            )
+        exporter.parse()
+
+        root = exporter.xmlRoot
+        helpers.indent(root)
+
+        self.header = exporter.xmlHeader()
+        self.root = root
+        self.preamble = []     # (element, serialized) pairs before the part list (titles, defaults, ...)
+        self.score_parts = []  # <score-part> entries of the part list
+        self.part_chunks = []  # Serialized <part> elements
+
+        for child in root:
+            if child.tag == 'part-list':
+                self.part_list = child
+                self.score_parts.extend(child.findall('score-part'))
+            elif child.tag == 'part':
+                child.tail = None  # Parts are re-joined by write_musicxml
+                self.part_chunks.append(_serialize(child))
+            elif child.tag is not ET.Comment:
+                # Serialized here, once: _serialize sorts attributes in place, so it must
+                # not run on elements that concurrent writes of this score share
+                self.preamble.append((child, _serialize(child)))
+
+
+def _serialize(element):
+    """Serialize an indented element (and its tail) with sorted attributes, as music21 does."""
+    for el in element.iter():
+        if len(el.attrib) > 1:
+            attribs = sorted(el.attrib.items())
+            el.attrib.clear()
+            el.attrib.update(attribs)
+    return ET.tostring(element, encoding='unicode').encode('utf-8')
+
+
+# Large enough to hold a whole score, so each output file is flushed in one write
+_WRITE_BUFFER_SIZE = 1 << 20
+
+_MXL_CONTAINER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<container>\n'
+    '  <rootfiles>\n'
+    '    <rootfile full-path="{}"/>\n'
+    '  </rootfiles>\n'
+    '</container>\n'
+)
+
+
+def write_musicxml(fp, exported_scores, title=None, compress=False):
+    """Stream the parts of one or more exported scores into a single MusicXML file.
+
+    Part XML is written from the already serialized chunks, so a part shared by
+    several output files is only ever serialized once. When ``title`` is given
+    it replaces the work and movement titles of the first score. With
+    ``compress`` the score is written as a compressed .mxl archive instead.
+    """
+    if not compress:
+        with open(fp, 'wb', buffering=_WRITE_BUFFER_SIZE) as f:
+            _write_score(f, exported_scores, title)
+        return
+
+    # The mimetype entry comes first and uncompressed, as the MXL format requires
+    inner_name = os.path.splitext(os.path.basename(fp))[0] + '.xml'
+    with zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        archive.writestr('mimetype', 'application/vnd.recordare.musicxml', compress_type=zipfile.ZIP_STORED)
+        archive.writestr('META-INF/container.xml', _MXL_CONTAINER.format(inner_name))
+        with archive.open(inner_name, 'w') as f:
+            _write_score(f, exported_scores, title)
+
+
+def _write_score(f, exported_scores, title):
+    """Write the MusicXML document for ``exported_scores`` to a binary file object."""
+    first = exported_scores[0]
+
+    # Merge every score-part into one part list, renumbering MIDI channels
+    part_list = copy.deepcopy(first.part_list)
+    last_tail = part_list[-1].tail if len(part_list) else None
+    part_list.clear()
+    part_list.text = first.part_list.text
+    for exported in exported_scores:
+        for score_part in exported.score_parts:
+            score_part = copy.deepcopy(score_part)
+            score_part.tail = part_list.text
+            part_list.append(score_part)
+    for channel, midi_channel in enumerate(part_list.iter('midi-channel'), start=1):
+        midi_channel.text = str(channel)
+    if len(part_list):
+        part_list[-1].tail = last_tail
+    part_list.tail = first.root.text
+
+    f.write(first.header)
+    attributes = ''.join(f' {name}="{value}"' for name, value in sorted(first.root.attrib.items()))
+    f.write(f'<{first.root.tag}{attributes}>{first.root.text or ""}'.encode('utf-8'))
+
+    for element, chunk in first.preamble:
+        if title is not None and element.tag in ('work', 'movement-title'):
+            element = copy.deepcopy(element)
+            title_el = element if element.tag == 'movement-title' else element.find('work-title')
+            if title_el is not None:
+                title_el.text = title
+            chunk = _serialize(element)
+        f.write(chunk)
+    f.write(_serialize(part_list))
+
+    part_chunks = [chunk for exported in exported_scores for chunk in exported.part_chunks]
+    f.write((first.root.text or '').encode('utf-8').join(part_chunks))
+
+    f.write(f'\n</{first.root.tag}>'.encode('utf-8'))
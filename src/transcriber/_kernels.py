@@ -0,0 +1,116 @@
+"""
+Transcriber - Compiled Kernels
+Numba-compiled inner loops over the numpy note and spectrum arrays used by
+BrassArranger and AudioTranscriber.
+Without Numba the same kernels run as whole-array numpy expressions.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # pragma: no cover - exercised only without numba installed
+    njit = None
+
+
+# Diatonic step (C=0 ... B=6) of each natural pitch class, and its inverse
+PITCH_CLASS_OF_STEP = np.array([0, 2, 4, 5, 7, 9, 11], dtype=np.int16)
+STEP_OF_PITCH_CLASS = np.array([0, -1, 1, -1, 2, 3, -1, 4, -1, 5, -1, 6], dtype=np.int16)
+
+
+def _arrange_notes_loop(ps, acc, degree_shift, semitone_shift, min_pitch, max_pitch,
+                        key_alter, suppress):
+    """Transpose, fit to range and flag key-signature accidentals in one pass.
+
+    ``ps`` and ``acc`` are updated in place. The transposition moves each note
+    ``degree_shift`` diatonic steps and ``semitone_shift`` semitones, so the
+    written spelling follows the interval. Notes are then moved by whole octaves
+    into ``[min_pitch, max_pitch]``. ``suppress[i]`` is set when the resulting
+    accidental is already implied by ``key_alter`` (alteration per step).
+    """
+    for i in range(ps.shape[0]):
+        p = ps[i]
+        natural = p - acc[i]
+        degree = (natural // 12) * 7 + STEP_OF_PITCH_CLASS[natural % 12] + degree_shift
+        step = degree % 7
+
+        p += semitone_shift
+        a = p - ((degree // 7) * 12 + PITCH_CLASS_OF_STEP[step])
+
+        # Branchless closed-form octave fitting: up to the minimum, then down to the maximum
+        p += 12 * max((min_pitch - p + 11) // 12, 0)
+        p -= 12 * max((p - max_pitch + 11) // 12, 0)
+
+        ps[i] = p
+        acc[i] = a
+        suppress[i] = a != 0 and key_alter[step] == a
+
+
+def _arrange_notes_numpy(ps, acc, degree_shift, semitone_shift, min_pitch, max_pitch,
+                         key_alter, suppress):
+    """Vectorized equivalent of _arrange_notes_loop for when Numba is unavailable."""
+    p = ps.astype(np.int32)
+    natural = p - acc
+    degree = (natural // 12) * 7 + STEP_OF_PITCH_CLASS[natural % 12] + degree_shift
+    step = degree % 7
+
+    p += semitone_shift
+    a = p - ((degree // 7) * 12 + PITCH_CLASS_OF_STEP[step])
+
+    # Closed-form octave fitting, applied only where a bound is crossed
+    p += 12 * np.maximum((min_pitch - p + 11) // 12, 0)
+    p -= 12 * np.maximum((p - max_pitch + 11) // 12, 0)
+
+    ps[:] = p
+    acc[:] = a
+    suppress[:] = (a != 0) & (key_alter[step] == a)
+
+
+def _strongest_peaks_loop(mags, peaks, bin_midi, count, threshold):
+    """Bins of the ``count`` strongest peaks, strongest first, that map to a note and exceed ``threshold``.
+
+    The strongest peaks are chosen before filtering, so a loud peak outside the
+    note range still takes one of the ``count`` slots.
+    """
+    taken = np.zeros(peaks.shape[0], dtype=np.bool_)
+    selected = np.empty(min(count, peaks.shape[0]), dtype=np.int64)
+    found = 0
+    for _ in range(selected.shape[0]):
+        # Strongest remaining peak; on ties the later bin wins, as a reversed argsort does
+        best = -1
+        for j in range(peaks.shape[0]):
+            if not taken[j] and (best < 0 or mags[peaks[j]] >= mags[peaks[best]]):
+                best = j
+        taken[best] = True
+
+        peak = peaks[best]
+        if bin_midi[peak] >= 0 and mags[peak] > threshold:
+            selected[found] = peak
+            found += 1
+    return selected[:found]
+
+
+def _strongest_peaks_numpy(mags, peaks, bin_midi, count, threshold):
+    """Vectorized equivalent of _strongest_peaks_loop for when Numba is unavailable."""
+    peak_mags = mags[peaks]
+    candidates = np.arange(len(peaks))
+    if len(peaks) > count:
+        # Partial selection of the strongest peaks; of peaks tied with the weakest
+        # one kept, the later bins win as in the loop
+        kth = np.partition(peak_mags, len(peaks) - count)[len(peaks) - count]
+        above = np.flatnonzero(peak_mags > kth)
+        tied = np.flatnonzero(peak_mags == kth)
+        candidates = np.sort(np.concatenate((above, tied[len(tied) - (count - len(above)):])))
+
+    # Strongest first, later bins first on ties
+    order = candidates[np.argsort(peak_mags[candidates], kind='stable')[::-1]]
+    strongest = peaks[order]
+    return strongest[(bin_midi[strongest] >= 0) & (mags[strongest] > threshold)]
+
+
+if njit is not None:
+    arrange_notes = njit(cache=True)(_arrange_notes_loop)
+    strongest_peaks = njit(cache=True)(_strongest_peaks_loop)
+else:
+    arrange_notes = _arrange_notes_numpy
+    strongest_peaks = _strongest_peaks_numpy
@@ -4,13 +4,63 @@ Transcriber - Brass Arrangement Module
 Takes a piano MusicXML file and arranges it for trumpet and trombone.
 """
 
+import concurrent.futures
 import copy
+import dataclasses
+import functools
+import logging
+import math
 import os
 import tempfile
+import threading
 import librosa
 import soundfile as sf
 import numpy as np
-from music21 import converter, stream, note, meter, key, instrument, bar, interval, clef, pitch
+from music21 import converter, stream, note, meter, key, instrument, bar, interval, clef, pitch, metadata, spanner
+from music21.stream.enums import GivenElementsBehavior
+
+# Prefer FFTW with cached plans for the onset spectra, then scipy's multithreaded
+# FFT; numpy's FFT is the fallback.
+try:
+    import pyfftw
+    import pyfftw.builders
+
+    def _build_fftw_rfft_plan(shape, dtype, axis):
+        """Measured FFTW real-FFT plan over an aligned input buffer of the given shape."""
+        return pyfftw.builders.rfft(
+            pyfftw.empty_aligned(shape, dtype=dtype), axis=axis, planner_effort='FFTW_MEASURE'
+        )
+
+    # A plan owns its input and output buffers, so each thread keeps its own plans
+    _fftw_local = threading.local()
+
+    def _fftw_rfft_plan(shape, dtype, axis):
+        """This thread's cached FFTW plan for the given shape."""
+        try:
+            build = _fftw_local.build
+        except AttributeError:
+            build = _fftw_local.build = functools.lru_cache(maxsize=16)(_build_fftw_rfft_plan)
+        return build(shape, dtype, axis)
+
+    def _rfft(frames, axis=-1):
+        """Real FFT of frames, reusing the plan and aligned buffers for repeated shapes."""
+        plan = _fftw_rfft_plan(frames.shape, frames.dtype.str, axis)
+        return plan(frames).copy()  # The plan's output buffer is reused by the next call
+except ImportError:
+    try:
+        import scipy.fft
+        _rfft = functools.partial(scipy.fft.rfft, workers=-1)
+    except ImportError:
+        _rfft = np.fft.rfft
+
+from ._kernels import STEP_OF_PITCH_CLASS, arrange_notes, strongest_peaks
+from ._fast_musicxml import (
+    ExportedScore, FastPart, make_duration, make_pitch, parse_parts_cached, parts_from_score,
+    write_musicxml
+)
+
+
+logger = logging.getLogger(__name__)
 
 
 # Musical constants
@@ -23,11 +73,81 @@ class Ranges:
     MIDDLE_C = 60     # Dividing line between treble and bass
 
 
+@functools.lru_cache(maxsize=256)
+def _get_interval(name):
+    """Return a shared music21 Interval for the given name (e.g. 'M2')."""
+    return interval.Interval(name)
+
+
 class Transposition:
     """Transposition intervals for instruments."""
-    BB_TRUMPET = interval.Interval('M2')  # Major 2nd up for Bb trumpet
-    OCTAVE_UP = interval.Interval('P8')
-    OCTAVE_DOWN = interval.Interval('-P8')
+    BB_TRUMPET = _get_interval('M2')  # Major 2nd up for Bb trumpet
+    OCTAVE_UP = _get_interval('P8')
+    OCTAVE_DOWN = _get_interval('-P8')
+
+
+# Steps (C=0 ... B=6) in the order sharps are added to a key signature; flats use the reverse
+_SHARP_ORDER_STEPS = np.array([3, 0, 4, 1, 5, 2, 6], dtype=np.int8)  # F C G D A E B
+
+
+def _build_key_step_alterations():
+    """Alteration of each step (C=0 ... B=6) implied by key signatures -7 to +7."""
+    table = np.zeros((15, 7), dtype=np.int8)
+    for sharps in range(1, 8):
+        table[sharps + 7, _SHARP_ORDER_STEPS[:sharps]] = 1
+        table[7 - sharps, _SHARP_ORDER_STEPS[::-1][:sharps]] = -1
+    return table
+
+
+# Indexed by [sharps + 7, step]
+_KEY_STEP_ALTER = _build_key_step_alterations()
+
+
+def _build_midi_alterations():
+    """Alteration music21 spells each MIDI note with (e.g. C#, E-, F#, G#, B-)."""
+    return np.array([int(pitch.Pitch(midi=midi).alter) for midi in range(128)], dtype=np.int8)
+
+
+# Indexed by MIDI note number
+_MIDI_ALTER = _build_midi_alterations()
+
+
+def _respell_inferred(ps, acc):
+    """Alterations music21's simplifyEnharmonic(mostCommon=True) gives inferred spellings.
+
+    Every note takes its default MIDI spelling, except that G# and A- are both kept.
+    """
+    keep = (ps % 12 == 8) & (np.abs(acc) == 1)
+    return np.where(keep, acc, _MIDI_ALTER[ps])
+
+
+@functools.lru_cache(maxsize=32)
+def _time_signature_prototype(ratio):
+    """Parsed music21 TimeSignature for a ratio string such as '4/4'."""
+    return meter.TimeSignature(ratio)
+
+
+def _time_signature(ratio):
+    """A new TimeSignature; copying a parsed one is cheaper than parsing the ratio again."""
+    return copy.deepcopy(_time_signature_prototype(ratio))
+
+
+def _make_barline(style, repeat=None, times=None):
+    """A music21 Barline, or a Repeat when the barline carries a repeat sign."""
+    if repeat is None:
+        return bar.Barline(style)
+    barline = bar.Repeat(direction=repeat, times=times)
+    if style is not None:
+        barline.type = style  # Otherwise keep the default look for the direction
+    return barline
+
+
+# Change in sharps (negative for flats) when a key is transposed up by each simple interval
+_INTERVAL_SHARP_DELTA = {
+    'P1': 0, 'A1': 7, 'd2': -12, 'm2': -5, 'M2': 2, 'A2': 9, 'd3': -10, 'm3': -3, 'M3': 4,
+    'A3': 11, 'd4': -8, 'P4': -1, 'A4': 6, 'd5': -6, 'P5': 1, 'A5': 8, 'd6': -11, 'm6': -4,
+    'M6': 3, 'A6': 10, 'd7': -9, 'm7': -2, 'M7': 5, 'A7': 12, 'd8': -7,
+}
 
 
 class KeySignatures:
@@ -35,19 +155,67 @@ class KeySignatures:
     @staticmethod
     def transpose_key_signature(original_key, transposition_interval):
         """Transpose a key signature by the given interval."""
-        if original_key.sharps == 0:  # C major
-            if transposition_interval.name == 'M2':  # Major 2nd up
-                return key.KeySignature(2)  # D major
-            elif transposition_interval.name == 'P5':  # Perfect 5th up
-                return key.KeySignature(1)  # G major
-        elif original_key.sharps == 1:  # G major
-            if transposition_interval.name == 'M2':  # Major 2nd up
-                return key.KeySignature(3)  # A major
-        elif original_key.sharps == 2:  # D major
-            if transposition_interval.name == 'M2':  # Major 2nd up
-                return key.KeySignature(4)  # E major
-        # Add more transpositions as needed
-        return original_key  # Default: return original if not handled
+        delta = _INTERVAL_SHARP_DELTA.get(transposition_interval.simpleName)
+        if delta is None:
+            return original_key  # Default: return original if not handled
+        if transposition_interval.semitones < 0:
+            delta = -delta  # Transposing down moves around the circle of fifths the other way
+        
+        # Keep the result within seven sharps or flats by switching to the enharmonic key
+        sharps = original_key.sharps + delta
+        while sharps > 7:
+            sharps -= 12
+        while sharps < -7:
+            sharps += 12
+        return key.KeySignature(sharps)
+
+
+# Sharps (negative for flats) of the major key on each tonic pitch class
+_MAJOR_KEY_SHARPS = np.array([
+    0,   # C major (no accidentals)
+    7,   # C# major (7 sharps)
+    2,   # D major (2 sharps)
+    -3,  # Eb major (3 flats)
+    4,   # E major (4 sharps)
+    -1,  # F major (1 flat)
+    6,   # F# major (6 sharps)
+    1,   # G major (1 sharp)
+    -4,  # Ab major (4 flats)
+    3,   # A major (3 sharps)
+    -2,  # Bb major (2 flats)
+    5,   # B major (5 sharps)
+], dtype=np.int8)
+
+
+# Note durations (seconds, upper bounds inclusive) quantized to the quarter lengths below
+_QUANTIZE_BOUNDS = np.array([
+    0.375,  # Eighth note or shorter
+    0.75,   # Quarter note
+    1.5,    # Half note
+])          # Whole note or longer
+_QUANTIZED_LENGTHS = np.array([0.5, 1.0, 2.0, 4.0])
+
+
+@functools.lru_cache(maxsize=8)
+def _load_audio_cached(path, mtime_ns, size, sr):
+    """Decode an audio file once per (path, mtime, size, sample rate)."""
+    audio, sr = librosa.load(path, sr=sr, mono=True, dtype=np.float32)
+    audio.setflags(write=False)  # Shared between callers, so keep it immutable
+    return audio, sr
+
+
+def _load_audio(path, sr):
+    """Load mono audio at the given sample rate, reusing earlier decodes of an unchanged file."""
+    stat = os.stat(path)
+    return _load_audio_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, sr)
+
+
+@functools.lru_cache(maxsize=4)
+def _mel_basis(sr, n_fft):
+    """Mel filterbank for onset detection, built once per (sample rate, FFT size)."""
+    basis = librosa.filters.mel(sr=sr, n_fft=n_fft)
+    basis.setflags(write=False)  # Shared between callers, so keep it immutable
+    return basis
 
 
 class AudioTranscriber:
@@ -67,8 +235,8 @@ class AudioTranscriber:
             return None
         
         try:
-            # Convert frequency to MIDI note number
-            midi_note = librosa.hz_to_midi(freq)
+            # Convert frequency to MIDI note number (A4 = 440Hz = MIDI 69)
+            midi_note = 12 * math.log2(freq / 440.0) + 69
             
             # Round to nearest semitone
             midi_note_rounded = int(round(midi_note))
@@ -77,17 +245,24 @@ class AudioTranscriber:
             if midi_note_rounded < 21 or midi_note_rounded > 108:  # Piano range
                 return None
             
-            # Create music21 pitch object
-            p = pitch.Pitch(midi=midi_note_rounded)
-            return note.Note(p)
+            # Create music21 pitch object, spelled as music21 spells MIDI notes
+            return note.Note(make_pitch(midi_note_rounded, _MIDI_ALTER[midi_note_rounded], inferred=True))
         except Exception:
             return None
     
     def _detect_onsets(self, audio, sr):
         """Detect note onsets in audio using spectral flux."""
+        # Log-power mel spectrogram as librosa's onset detection builds it, but
+        # projected with a filterbank that is only computed once per sample rate
+        power = np.abs(librosa.stft(audio, n_fft=self.frame_length, hop_length=self.hop_length)) ** 2
+        mel_power = np.einsum('...ft,mf->...mt', power, _mel_basis(sr, self.frame_length), optimize=True)
+        onset_envelope = librosa.onset.onset_strength(
+            S=librosa.power_to_db(mel_power), sr=sr, hop_length=self.hop_length
+        )
+        
         # Use librosa's onset detection
         onset_frames = librosa.onset.onset_detect(
-            y=audio, 
+            onset_envelope=onset_envelope, 
             sr=sr, 
             hop_length=self.hop_length,
             units='time',
@@ -95,72 +270,108 @@ class AudioTranscriber:
         )
         return onset_frames
     
+    def _frequency_bins_to_midi(self, freqs):
+        """MIDI note of each frequency bin, as _frequency_to_note rounds it, or -1 if unusable."""
+        midi_notes = np.full(len(freqs), -1, dtype=np.int16)
+        
+        # Bin frequencies ascend, so the usable range is one slice rather than a mask
+        lo = np.searchsorted(freqs, 20, side='right')    # Reasonable frequency range
+        hi = np.searchsorted(freqs, 4000, side='right')  # for musical notes
+        rounded = np.round(12 * np.log2(freqs[lo:hi] / 440.0) + 69).astype(np.int16)
+        midi_notes[lo:hi] = np.where((rounded >= 21) & (rounded <= 108), rounded, -1)  # Piano range
+        return midi_notes
+    
+    def _onset_spectra(self, audio, sr, onset_times):
+        """Positive-frequency (freqs, magnitudes, bin MIDI notes, peak bins) after each onset, or None."""
+        # Create analysis windows around the onsets
+        window_duration = 0.3  # 300ms window
+        start_times = np.maximum(0, np.asarray(onset_times, dtype=float) - 0.05)  # Start slightly before onset
+        end_times = np.minimum(len(audio) / sr, start_times + window_duration)
+        start_samples = (start_times * sr).astype(int)
+        end_samples = (end_times * sr).astype(int)
+        lengths = end_samples - start_samples
+        
+        # One batched real FFT per distinct window length (all full windows share one)
+        spectra = [None] * len(lengths)
+        for length in np.unique(lengths[lengths > 0]):
+            indices = np.flatnonzero(lengths == length)
+            # Single precision throughout: scipy.fft and FFTW keep float32 input in complex64
+            # Gather every window of this length from a strided view in one copy
+            windows = np.lib.stride_tricks.sliding_window_view(audio, length)
+            frames = windows[start_samples[indices]].astype(np.float32, copy=False)
+            
+            # Only positive frequencies, matching the first half of a full FFT. Peak
+            # picking averages magnitudes, so they are needed as-is (not squared),
+            # but only for the bins that are kept.
+            magnitudes = np.abs(_rfft(frames, axis=1)[:, :length//2])
+            
+            # The bins are fixed for a window length, so map them to notes once
+            pos_freqs = np.fft.rfftfreq(length, 1/sr)[:length//2]
+            bin_midi = self._frequency_bins_to_midi(pos_freqs)
+            
+            # Find spectral peaks of every window in one call along the frequency axis
+            peaks = librosa.util.peak_pick(
+                magnitudes, 
+                pre_max=10, 
+                post_max=10, 
+                pre_avg=5, 
+                post_avg=5, 
+                delta=0.1, 
+                wait=5,
+                sparse=False,
+                axis=-1
+            )
+            for row, i in enumerate(indices):
+                spectra[i] = (pos_freqs, magnitudes[row], bin_midi, np.flatnonzero(peaks[row]))
+        
+        return spectra
+    
+    def _notes_from_peaks(self, onset_times, midi_notes, freqs, label):
+        """Build (onset time, note) pairs for detected peaks."""
+        notes = []
+        debug = logger.isEnabledFor(logging.DEBUG)  # Checked once, not per note
+        for onset_time, midi_note, freq in zip(onset_times.tolist(), midi_notes.tolist(), freqs.tolist()):
+            note_obj = note.Note(make_pitch(midi_note, _MIDI_ALTER[midi_note], inferred=True))
+            notes.append((onset_time, note_obj))
+            if debug:
+                logger.debug("%s note at %.2fs: %s (%.1fHz)", label, onset_time, note_obj.pitch, freq)
+        return notes
+    
     def _extract_notes_from_audio(self, audio, sr):
         """Extract notes using generic onset detection and frequency analysis."""
         # Detect onsets
         onset_times = self._detect_onsets(audio, sr)
         
-        print(f"Debug: Detected {len(onset_times)} onsets at times: {onset_times}")
+        logger.debug("Detected %d onsets at times: %s", len(onset_times), onset_times)
         
-        treble_notes = []
-        bass_notes = []
+        peak_onsets = []
+        peak_midi = []
+        peak_freqs = []
         
         # Analyze each onset
-        for onset_time in onset_times:
-            # Create analysis window around onset
-            window_duration = 0.3  # 300ms window
-            start_time = max(0, onset_time - 0.05)  # Start slightly before onset
-            end_time = min(len(audio) / sr, start_time + window_duration)
-            
-            start_sample = int(start_time * sr)
-            end_sample = int(end_time * sr)
-            
-            if end_sample > start_sample:
-                window = audio[start_sample:end_sample]
-                
-                # Spectral analysis
-                fft = np.fft.fft(window)
-                freqs = np.fft.fftfreq(len(window), 1/sr)
-                magnitudes = np.abs(fft)
-                
-                # Only positive frequencies
-                pos_freqs = freqs[:len(freqs)//2]
-                pos_mags = magnitudes[:len(magnitudes)//2]
-                
-                # Find spectral peaks
-                peak_indices = librosa.util.peak_pick(
-                    pos_mags, 
-                    pre_max=10, 
-                    post_max=10, 
-                    pre_avg=5, 
-                    post_avg=5, 
-                    delta=0.1, 
-                    wait=5
-                )
+        for onset_time, spectrum in zip(onset_times, self._onset_spectra(audio, sr, onset_times)):
+            if spectrum is not None:
+                pos_freqs, pos_mags, bin_midi, peak_indices = spectrum
                 
-                # Sort peaks by magnitude
-                if len(peak_indices) > 0:
-                    peak_freqs = pos_freqs[peak_indices]
-                    peak_mags = pos_mags[peak_indices]
-                    
-                    # Sort by magnitude (descending)
-                    sorted_indices = np.argsort(peak_mags)[::-1]
-                    
-                    # Process the strongest peaks
-                    for idx in sorted_indices[:4]:  # Top 4 peaks max
-                        freq = peak_freqs[idx]
-                        magnitude = peak_mags[idx]
-                        
-                        # Convert to note
-                        note_obj = self._frequency_to_note(freq)
-                        if note_obj and magnitude > 0.05:  # Minimum magnitude threshold
-                            # Classify as treble or bass based on pitch
-                            if note_obj.pitch.ps >= Ranges.MIDDLE_C:
-                                treble_notes.append((onset_time, note_obj))
-                                print(f"Debug: Treble note at {onset_time:.2f}s: {note_obj.pitch.name}{note_obj.pitch.octave} ({freq:.1f}Hz)")
-                            else:
-                                bass_notes.append((onset_time, note_obj))
-                                print(f"Debug: Bass note at {onset_time:.2f}s: {note_obj.pitch.name}{note_obj.pitch.octave} ({freq:.1f}Hz)")
+                # Strongest peaks (top 4 max) that map to a note and pass the
+                # minimum magnitude threshold, in one compiled pass
+                peaks = strongest_peaks(pos_mags, peak_indices, bin_midi, 4, 0.05)
+                peak_onsets.append(np.full(len(peaks), onset_time))
+                peak_midi.append(bin_midi[peaks])
+                peak_freqs.append(pos_freqs[peaks])
+        
+        if not peak_onsets:
+            return [], []
+        peak_onsets = np.concatenate(peak_onsets)
+        peak_midi = np.concatenate(peak_midi)
+        peak_freqs = np.concatenate(peak_freqs)
+        
+        # Classify every detected note as treble or bass based on pitch at once
+        is_treble = peak_midi >= Ranges.MIDDLE_C
+        treble_notes = self._notes_from_peaks(peak_onsets[is_treble], peak_midi[is_treble],
+                                              peak_freqs[is_treble], "Treble")
+        bass_notes = self._notes_from_peaks(peak_onsets[~is_treble], peak_midi[~is_treble],
+                                            peak_freqs[~is_treble], "Bass")
         
         return treble_notes, bass_notes
     
@@ -179,7 +390,7 @@ class AudioTranscriber:
         if not notes:
             # Create a single empty measure if no notes
             measure = stream.Measure(number=1)
-            measure.insert(0, meter.TimeSignature('4/4'))
+            measure.insert(0, _time_signature('4/4'))
             if key_sig:
                 measure.insert(0, key_sig)
             if clef_obj:
@@ -200,35 +411,40 @@ class AudioTranscriber:
         
         num_measures = max(1, int(np.ceil(audio_duration / seconds_per_measure)))
         
-        print(f"Debug: Creating {num_measures} measures for {len(notes)} notes over {audio_duration:.2f}s")
+        logger.debug("Creating %d measures for %d notes over %.2fs", num_measures, len(notes), audio_duration)
         
-        # Create measures
-        measures = []
-        for i in range(num_measures):
-            measure = stream.Measure(number=i + 1)
-            if i == 0:
-                measure.insert(0, meter.TimeSignature('4/4'))
-                if key_sig:
-                    measure.insert(0, key_sig)
-                if clef_obj:
-                    measure.insert(0, clef_obj)
-            measures.append(measure)
+        # Collect the elements of every measure, starting with the first measure's header
+        measure_elements = [[] for _ in range(num_measures)]
+        measure_elements[0].append(_time_signature('4/4'))
+        if key_sig:
+            measure_elements[0].append(key_sig)
+        if clef_obj:
+            measure_elements[0].append(clef_obj)
+        
+        # Calculate which measure and beat offset every note falls on in one go
+        onset_times = np.array([onset_time for onset_time, _ in notes], dtype=float)
+        measure_indices = np.minimum((onset_times // seconds_per_measure).astype(int), num_measures - 1)
+        beat_offsets = (onset_times % seconds_per_measure) / seconds_per_beat
         
         # Distribute notes across measures
-        for onset_time, music_note in notes:
-            # Calculate which measure and beat offset
-            measure_index = min(int(onset_time / seconds_per_measure), num_measures - 1)
-            time_in_measure = onset_time % seconds_per_measure
-            beat_offset = time_in_measure / seconds_per_beat
+        debug = logger.isEnabledFor(logging.DEBUG)  # Checked once, not per note
+        for onset_time, music_note, measure_index, beat_offset in zip(
+            onset_times.tolist(), (music_note for _, music_note in notes),
+            measure_indices.tolist(), beat_offsets.tolist()
+        ):
+            if debug:
+                logger.debug("Note at %.2fs -> measure %d, beat %.2f", onset_time, measure_index + 1, beat_offset)
             
-            print(f"Debug: Note at {onset_time:.2f}s -> measure {measure_index + 1}, beat {beat_offset:.2f}")
-            
-            # Add note to measure
-            measures[measure_index].insert(beat_offset, music_note)
+            # Add note to its measure at its beat
+            music_note.offset = beat_offset
+            measure_elements[measure_index].append(music_note)
         
-        # Add measures to part
-        for measure in measures:
-            part.append(measure)
+        # Create every measure with a single insertion pass and add them to the part at once
+        measures = [
+            stream.Measure(elements, givenElementsBehavior=GivenElementsBehavior.INSERT, number=i + 1)
+            for i, elements in enumerate(measure_elements)
+        ]
+        part.append(measures)
         
         return part
     
@@ -238,40 +454,18 @@ class AudioTranscriber:
         if not notes:
             return key.KeySignature(0)  # Default to C major
         
-        # Collect all pitch classes
-        pitch_classes = []
-        for _, note_obj in notes:
-            pitch_classes.append(note_obj.pitch.pitchClass)
-        
-        # Count occurrences
-        pc_counts = {}
-        for pc in pitch_classes:
-            pc_counts[pc] = pc_counts.get(pc, 0) + 1
+        # Count occurrences of every pitch class in one pass
+        pitch_classes = np.fromiter(
+            (note_obj.pitch.pitchClass for _, note_obj in notes), dtype=np.intp, count=len(notes)
+        )
+        pc_counts = np.bincount(pitch_classes, minlength=12)
         
-        # Simple heuristic: find the most common major/minor key
+        # Simple heuristic: the most frequent pitch class is the tonic of a major key;
+        # on ties the pitch class heard first wins.
         # This is a simplified approach - could be enhanced with proper key detection algorithms
-        major_keys = {
-            0: 0,   # C major (no accidentals)
-            7: 1,   # G major (1 sharp)
-            2: 2,   # D major (2 sharps) 
-            9: 3,   # A major (3 sharps)
-            4: 4,   # E major (4 sharps)
-            11: 5,  # B major (5 sharps)
-            6: 6,   # F# major (6 sharps)
-            1: 7,   # C# major (7 sharps)
-            5: -1,  # F major (1 flat)
-            10: -2, # Bb major (2 flats)
-            3: -3,  # Eb major (3 flats)
-            8: -4,  # Ab major (4 flats)
-        }
-        
-        # Find most frequent pitch class as potential tonic
-        if pc_counts:
-            most_common_pc = max(pc_counts, key=pc_counts.get)
-            if most_common_pc in major_keys:
-                return key.KeySignature(major_keys[most_common_pc])
-        
-        return key.KeySignature(0)  # Default to C major
+        is_most_common = pc_counts[pitch_classes] == pc_counts.max()
+        most_common_pc = pitch_classes[np.argmax(is_most_common)]
+        return key.KeySignature(int(_MAJOR_KEY_SHARPS[most_common_pc]))
     
     def _estimate_note_durations(self, notes):
         """Estimate note durations based on onset timing."""
@@ -279,27 +473,21 @@ class AudioTranscriber:
             return notes
         
         notes_with_duration = []
-        sorted_notes = sorted(notes, key=lambda x: x[0])  # Sort by onset time
         
-        for i, (onset_time, note_obj) in enumerate(sorted_notes):
-            if i < len(sorted_notes) - 1:
-                # Duration until next note
-                next_onset = sorted_notes[i + 1][0]
-                duration = next_onset - onset_time
-            else:
-                # Last note gets a default duration
-                duration = 0.5
-            
-            # Quantize duration to common note values
-            if duration <= 0.375:  # Eighth note or shorter
-                note_obj.quarterLength = 0.5
-            elif duration <= 0.75:  # Quarter note
-                note_obj.quarterLength = 1.0
-            elif duration <= 1.5:   # Half note
-                note_obj.quarterLength = 2.0
-            else:                   # Whole note or longer
-                note_obj.quarterLength = 4.0
-            
+        # Onset times and notes as parallel sequences, sorted by onset time
+        onset_times = np.array([onset_time for onset_time, _ in notes])
+        order = np.argsort(onset_times, kind='stable')
+        note_objs = [notes[i][1] for i in order]
+        onset_times = onset_times[order]
+        
+        # Duration until the next note; the last note gets a default duration
+        durations = np.append(np.diff(onset_times), 0.5)
+        
+        # Quantize every duration to common note values in one binary search
+        quarter_lengths = _QUANTIZED_LENGTHS[np.searchsorted(_QUANTIZE_BOUNDS, durations)]
+        
+        for onset_time, note_obj, quarter_length in zip(onset_times, note_objs, quarter_lengths.tolist()):
+            note_obj.quarterLength = quarter_length
             notes_with_duration.append((onset_time, note_obj))
         
         return notes_with_duration
@@ -308,13 +496,13 @@ class AudioTranscriber:
     def transcribe_to_midi(self, audio_path):
         """Transcribe audio file using generic onset detection and frequency analysis."""
         # Load audio
-        audio, sr = librosa.load(audio_path, sr=self.sr, mono=True)
+        audio, sr = _load_audio(audio_path, self.sr)
         audio_duration = len(audio) / sr
         
         # Extract notes using generic method
         treble_notes, bass_notes = self._extract_notes_from_audio(audio, sr)
         
-        print(f"Debug: Extracted {len(treble_notes)} treble notes, {len(bass_notes)} bass notes")
+        logger.debug("Extracted %d treble notes, %d bass notes", len(treble_notes), len(bass_notes))
         
         # Estimate note durations
         treble_notes = self._estimate_note_durations(treble_notes)
@@ -324,7 +512,7 @@ class AudioTranscriber:
         all_notes = treble_notes + bass_notes
         detected_key = self._detect_key_signature(all_notes)
         
-        print(f"Debug: Detected key signature: {detected_key}")
+        logger.debug("Detected key signature: %s", detected_key)
         
         # Create music21 score
         score = stream.Score()
@@ -357,130 +545,186 @@ class AudioTranscriber:
 class BrassArranger:
     """Arranges piano scores for brass instruments."""
     
-    def __init__(self, input_file):
-        """Initialize the brass arranger with a MusicXML or audio file."""
+    def __init__(self, input_file, cache_dir=None):
+        """Initialize the brass arranger with a MusicXML or audio file.
+
+        ``cache_dir`` is where parsed MusicXML is cached; None uses default_cache_dir().
+        """
         self.input_file = input_file
+        self.cache_dir = cache_dir
         self.is_audio_file = self._is_audio_file(input_file)
-        
-        if self.is_audio_file:
-            # Transcribe audio to score first
-            transcriber = AudioTranscriber()
-            self.score = transcriber.transcribe_to_midi(input_file)
-        else:
-            # Parse MusicXML directly
-            self.score = converter.parse(input_file)
-        
-        self.treble_part = None
-        self.bass_part = None
-        self._extract_parts()
+        self._score = None
+    
+    @property
+    def score(self):
+        """The input as a full music21 Score, loaded on first access."""
+        if self._score is None:
+            if self.is_audio_file:
+                # Transcribe audio to score first
+                transcriber = AudioTranscriber()
+                self._score = transcriber.transcribe_to_midi(self.input_file)
+            else:
+                self._score = converter.parse(self.input_file)
+        return self._score
+    
+    @functools.cached_property
+    def _parts(self):
+        """Measure data for every staff of the input, loaded on first access."""
+        if not self.is_audio_file and self._is_musicxml_file(self.input_file):
+            # Stream MusicXML straight into lightweight measure data, reusing the disk cache
+            return parse_parts_cached(self.input_file, cache_dir=self.cache_dir)
+        # Audio and other notation formats go through a music21 Score
+        return parts_from_score(self.score)
+    
+    @functools.cached_property
+    def _treble_and_bass(self):
+        """The (treble, bass) parts, extracted on first access."""
+        return self._extract_parts()
+    
+    @property
+    def treble_part(self):
+        """Treble clef part of the input."""
+        return self._treble_and_bass[0]
+    
+    @property
+    def bass_part(self):
+        """Bass clef part of the input."""
+        return self._treble_and_bass[1]
     
     def _is_audio_file(self, file_path):
         """Check if the input file is an audio file."""
         audio_extensions = {'.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg'}
         return os.path.splitext(file_path.lower())[1] in audio_extensions
     
+    def _is_musicxml_file(self, file_path):
+        """Check if the input file is a plain or compressed MusicXML file."""
+        musicxml_extensions = {'.xml', '.musicxml', '.mxl'}
+        return os.path.splitext(file_path.lower())[1] in musicxml_extensions
+    
     def _extract_parts(self):
         """Extract treble and bass clef parts from the score."""
-        if len(self.score.parts) >= 2:
+        if len(self._parts) >= 2:
             # Score already has separate parts (most common case)
-            self.treble_part = self.score.parts[0]  # Higher pitches
-            self.bass_part = self.score.parts[1]    # Lower pitches
-        else:
-            # Single part - split by pitch height
-            self._split_single_part_by_pitch()
+            return self._parts[0], self._parts[1]  # Higher pitches, lower pitches
+        # Single part - split by pitch height
+        return self._split_single_part_by_pitch()
     
     def _split_single_part_by_pitch(self):
         """Split a single piano part into treble and bass by pitch height."""
-        piano_part = self.score.parts[0]
-        self.treble_part = stream.Part()
-        self.bass_part = stream.Part()
-        
-        # Copy time/key signatures to both parts
-        for element in piano_part.getElementsByClass([meter.TimeSignature, key.KeySignature]):
-            self.treble_part.append(element)
-            self.bass_part.append(element)
-        
-        # Separate notes by pitch height
-        for measure in piano_part.getElementsByClass('Measure'):
-            treble_measure = stream.Measure(number=measure.number)
-            bass_measure = stream.Measure(number=measure.number)
-            
-            for element in measure.notesAndRests:
-                if isinstance(element, note.Note):
-                    # Split at middle C
-                    if element.pitch.ps >= Ranges.MIDDLE_C:
-                        treble_measure.append(element)
-                    else:
-                        bass_measure.append(element)
-                else:  # Rests go to both parts
-                    treble_measure.append(element)
-                    bass_measure.append(element)
-            
-            self.treble_part.append(treble_measure)
-            self.bass_part.append(bass_measure)
-    
-    def _transpose_note_to_range(self, note_obj, min_pitch, max_pitch):
-        """Transpose a note to fit within the specified range."""
-        # Move note into comfortable range using octave transpositions
-        while note_obj.pitch.ps < min_pitch:
-            note_obj.pitch = note_obj.pitch.transpose(Transposition.OCTAVE_UP)
+        piano_part = self._parts[0]
+        treble_part = FastPart()
+        bass_part = FastPart()
+        
+        if not piano_part.measures:
+            return treble_part, bass_part
+        
+        # Compare every pitch of the part against middle C at once
+        measures = piano_part.measures
+        all_notes = np.concatenate([measure.notes for measure in measures])
+        measure_of_note = np.repeat(np.arange(len(measures)), [len(m.notes) for m in measures])
+        is_treble = all_notes['ps'] >= Ranges.MIDDLE_C
+        
+        # Cut the treble and bass notes back into measures by their per-measure counts
+        treble_counts = np.bincount(measure_of_note[is_treble], minlength=len(measures))
+        bass_counts = np.bincount(measure_of_note[~is_treble], minlength=len(measures))
+        treble_notes = np.split(all_notes[is_treble], np.cumsum(treble_counts)[:-1])
+        bass_notes = np.split(all_notes[~is_treble], np.cumsum(bass_counts)[:-1])
+        
+        # Time/key signatures and rests go to both parts
+        for index, (measure, treble, bass) in enumerate(zip(measures, treble_notes, bass_notes)):
+            treble_inferred = bass_inferred = None
+            if measure.inferred is not None:
+                in_treble = is_treble[measure_of_note == index]
+                treble_inferred = measure.inferred[in_treble]
+                bass_inferred = measure.inferred[~in_treble]
+            treble_part.measures.append(
+                dataclasses.replace(measure, notes=treble, inferred=treble_inferred)
+            )
+            bass_part.measures.append(
+                dataclasses.replace(measure, notes=bass, inferred=bass_inferred)
+            )
         
-        while note_obj.pitch.ps > max_pitch:
-            note_obj.pitch = note_obj.pitch.transpose(Transposition.OCTAVE_DOWN)
+        return treble_part, bass_part
+    
+    def _arrange_fast_part(self, source_part, transposition_interval=None,
+                           min_range=None, max_range=None, key_sharps=0):
+        """Transpose and range-adjust every measure of a part, returning a new FastPart."""
+        degree_shift = transposition_interval.generic.staffDistance if transposition_interval else 0
+        semitone_shift = int(transposition_interval.semitones) if transposition_interval else 0
+        if min_range is None or max_range is None:
+            min_range, max_range = 0, 127  # No range adjustment
+        key_alter = _KEY_STEP_ALTER[max(-7, min(7, key_sharps)) + 7]
+        
+        arranged = FastPart()
+        for measure in source_part.measures:
+            # One compiled pass per measure over its note arrays
+            notes = measure.notes.copy()
+            suppress = np.zeros(len(notes), dtype=np.bool_)
+            arrange_notes(
+                notes['ps'], notes['acc'], degree_shift, semitone_shift,
+                min_range, max_range, key_alter, suppress
+            )
+            if measure.inferred is not None:
+                self._respell_inferred_notes(
+                    measure, notes, suppress, transposition_interval is not None, key_alter
+                )
+            arranged.measures.append(dataclasses.replace(measure, notes=notes, suppress=suppress))
         
-        return note_obj
+        return arranged
     
-    def _suppress_key_signature_accidentals(self, note_obj, key_sig):
-        """Remove visual accidentals that are already implied by the key signature."""
-        if not (hasattr(note_obj.pitch, 'accidental') and note_obj.pitch.accidental):
+    @staticmethod
+    def _respell_inferred_notes(source_measure, notes, suppress, transposed, key_alter):
+        """Respell inferred (audio) notes that were transposed, as Pitch.transpose does."""
+        respell = source_measure.inferred.copy()
+        if not transposed:
+            # Only notes moved into range went through a transposition
+            respell &= notes['ps'] != source_measure.notes['ps']
+        if not respell.any():
             return
         
-        step = note_obj.pitch.step
-        accidental_name = note_obj.pitch.accidental.name
-        
-        # Get the accidentals implied by the key signature
-        key_accidentals = key_sig.alteredPitches
-        
-        # Check if this note's accidental is implied by the key signature
-        for altered_pitch in key_accidentals:
-            if (step == altered_pitch.step and 
-                accidental_name == altered_pitch.accidental.name):
-                note_obj.pitch.accidental.displayStatus = False
-                break
-    
-    def _process_measure_elements(self, source_measure, target_measure, 
-                                  transposition_interval=None, 
-                                  min_range=None, max_range=None,
-                                  key_sig=None):
-        """Process notes and rests from source measure to target measure."""
-        # Copy barlines (only final ones)
-        for barline in source_measure.getElementsByClass(bar.Barline):
-            if barline.location == 'right':
-                target_measure.rightBarline = barline
-        
-        # Process each musical element
-        for element in source_measure.notesAndRests:
-            if isinstance(element, note.Note):
-                # Create new note with same pitch and duration
-                new_note = note.Note(element.pitch, quarterLength=element.quarterLength)
-                
-                # Apply transposition if specified
-                if transposition_interval:
-                    new_note.pitch = new_note.pitch.transpose(transposition_interval)
-                
-                # Adjust to instrument range if specified
-                if min_range is not None and max_range is not None:
-                    new_note = self._transpose_note_to_range(new_note, min_range, max_range)
+        ps = notes['ps'][respell].astype(np.int64)
+        acc = _respell_inferred(ps, notes['acc'][respell])
+        notes['acc'][respell] = acc
+        step = STEP_OF_PITCH_CLASS[(ps - acc) % 12]
+        suppress[respell] = (acc != 0) & (key_alter[step] == acc)
+    
+    def _process_measure_elements(self, source_measure):
+        """Build the music21 elements of an arranged measure, in order."""
+        elements = []
+        
+        # Copy time signature changes
+        if source_measure.time_sig is not None:
+            elements.append(_time_signature('%d/%d' % source_measure.time_sig))
+        
+        notes = source_measure.notes
+        rests = source_measure.rests
+        suppress = source_measure.suppress
+        if suppress is None:
+            suppress = np.zeros(len(notes), dtype=np.bool_)
+        
+        # Final note state from the fused arrangement pass, read as plain Python values once
+        note_values = list(zip(
+            notes['ps'].tolist(), notes['acc'].tolist(), notes['ql'].tolist(), suppress.tolist()
+        ))
+        rest_lengths = rests['ql'].tolist()
+        
+        # Process notes and rests in time order
+        order = np.argsort(np.concatenate((notes['offset'], rests['offset'])), kind='stable').tolist()
+        
+        for index in order:
+            if index < len(note_values):
+                ps, acc, quarter_length, hide_accidental = note_values[index]
+                new_note = note.Note(make_pitch(ps, acc), duration=make_duration(quarter_length))
                 
-                # Handle key signature accidentals
-                if key_sig:
-                    self._suppress_key_signature_accidentals(new_note, key_sig)
+                # Hide accidentals already implied by the key signature
+                if hide_accidental:
+                    new_note.pitch.accidental.displayStatus = False
                 
-                target_measure.append(new_note)
+                elements.append(new_note)
             else:
-                # Copy rests as-is
-                new_rest = note.Rest(quarterLength=element.quarterLength)
-                target_measure.append(new_rest)
+                elements.append(note.Rest(duration=make_duration(rest_lengths[index - len(note_values)])))
+        
+        return elements
     
     def _setup_instrument_part(self, instrument_obj, clef_obj=None, key_sig=None):
         """Create a new part with instrument, clef, and key signature."""
@@ -495,100 +739,115 @@ class BrassArranger:
         
         return part
     
-    def arrange_for_trumpet(self):
-        """Arrange the treble part for Bb trumpet."""
+    @functools.cached_property
+    def _trumpet_data(self):
+        """The trumpet key (in sharps) and arranged measures, computed on first access."""
         # Get original key signature from treble part
-        original_key = None
-        for element in self.treble_part.getElementsByClass(key.KeySignature):
-            original_key = element
-            break
-        
-        if original_key is None:
-            original_key = key.KeySignature(0)  # Default to C major
+        original_sharps = self.treble_part.first_key_signature()
+        original_key = key.KeySignature(original_sharps or 0)  # Default to C major
         
         # Transpose key signature for Bb trumpet
         transposed_key = KeySignatures.transpose_key_signature(original_key, Transposition.BB_TRUMPET)
         
-        # Set up trumpet part
-        trumpet_part = self._setup_instrument_part(
-            instrument.Trumpet(), 
-            key_sig=transposed_key
+        arranged = self._arrange_fast_part(
+            self.treble_part,
+            transposition_interval=Transposition.BB_TRUMPET,
+            min_range=Ranges.TRUMPET_MIN,
+            max_range=Ranges.TRUMPET_MAX,
+            key_sharps=transposed_key.sharps
         )
+        return transposed_key.sharps, arranged
+    
+    @functools.cached_property
+    def _trombone_data(self):
+        """The trombone key (in sharps) and arranged measures, computed on first access."""
+        # Trombone stays in concert pitch, so use original key
+        original_sharps = self.bass_part.first_key_signature() or 0  # Default to C major
+        
+        arranged = self._arrange_fast_part(
+            self.bass_part,
+            transposition_interval=None,  # Concert pitch, no transposition
+            min_range=Ranges.TROMBONE_MIN,
+            max_range=Ranges.TROMBONE_MAX,
+            key_sharps=original_sharps
+        )
+        return original_sharps, arranged
+    
+    def _build_part(self, arranged, instrument_obj, key_sig, clef_obj=None):
+        """Materialize a fresh music21 Part from arranged measure data."""
+        part = self._setup_instrument_part(instrument_obj, clef_obj=clef_obj, key_sig=key_sig)
         
-        # Copy time signatures
-        for element in self.treble_part.getElementsByClass(meter.TimeSignature):
-            trumpet_part.append(element)
-        
-        # Process each measure
-        for measure in self.treble_part.getElementsByClass('Measure'):
-            new_measure = stream.Measure(number=measure.number)
-            
-            self._process_measure_elements(
-                source_measure=measure,
-                target_measure=new_measure,
-                transposition_interval=Transposition.BB_TRUMPET,
-                min_range=Ranges.TRUMPET_MIN,
-                max_range=Ranges.TRUMPET_MAX,
-                key_sig=transposed_key
+        measures = []
+        brackets = []
+        open_bracket = None
+        for measure in arranged.measures:
+            # Fill each measure from its element list in one pass
+            new_measure = stream.Measure(
+                self._process_measure_elements(measure),
+                givenElementsBehavior=GivenElementsBehavior.APPEND,
+                number=measure.number
             )
+            new_measure.numberSuffix = measure.number_suffix
+            # Pickups and short bars keep their length instead of being filled with rests
+            new_measure.paddingLeft = measure.padding_left
+            new_measure.paddingRight = measure.padding_right
+            if measure.implicit:
+                new_measure.showNumber = stream.enums.ShowNumber.NEVER
+            if measure.left_barline is not None or measure.left_repeat is not None:
+                new_measure.leftBarline = _make_barline(measure.left_barline, measure.left_repeat)
+            if measure.barline is not None or measure.repeat is not None:
+                new_measure.rightBarline = _make_barline(
+                    measure.barline, measure.repeat, measure.repeat_times
+                )
             
-            trumpet_part.append(new_measure)
+            # Endings span from the measure that starts them to the one that stops them
+            if measure.ending is not None:
+                open_bracket = spanner.RepeatBracket(new_measure, number=measure.ending)
+                brackets.append(open_bracket)
+            if measure.ending_stop:
+                if open_bracket is None:
+                    open_bracket = spanner.RepeatBracket(number=1)
+                    brackets.append(open_bracket)
+                if not open_bracket.hasSpannedElement(new_measure):
+                    open_bracket.addSpannedElements(new_measure)
+                open_bracket = None
+            measures.append(new_measure)
+        
+        # Append all measures at once so the part's caches are rebuilt only once
+        part.append(measures)
+        for bracket in brackets:
+            part.insert(0, bracket)
         
-        return trumpet_part
+        return part
+    
+    def arrange_for_trumpet(self):
+        """Arrange the treble part for Bb trumpet."""
+        sharps, arranged = self._trumpet_data
+        return self._build_part(arranged, instrument.Trumpet(), key.KeySignature(sharps))
     
     def arrange_for_trombone(self):
         """Arrange the bass part for trombone (concert pitch)."""
-        # Get original key signature from bass part
-        original_key = None
-        for element in self.bass_part.getElementsByClass(key.KeySignature):
-            original_key = element
-            break
-        
-        if original_key is None:
-            original_key = key.KeySignature(0)  # Default to C major
-        
-        # Trombone stays in concert pitch, so use original key
-        trombone_part = self._setup_instrument_part(
+        sharps, arranged = self._trombone_data
+        return self._build_part(
+            arranged,
             instrument.Trombone(),
-            clef_obj=clef.BassClef(),
-            key_sig=original_key
+            key.KeySignature(sharps),
+            clef_obj=clef.BassClef()
         )
-        
-        # Copy time signatures
-        for element in self.bass_part.getElementsByClass(meter.TimeSignature):
-            trombone_part.append(element)
-        
-        # Process each measure
-        for measure in self.bass_part.getElementsByClass('Measure'):
-            new_measure = stream.Measure(number=measure.number)
-            
-            self._process_measure_elements(
-                source_measure=measure,
-                target_measure=new_measure,
-                transposition_interval=None,  # Concert pitch, no transposition
-                min_range=Ranges.TROMBONE_MIN,
-                max_range=Ranges.TROMBONE_MAX,
-                key_sig=original_key
-            )
-            
-            trombone_part.append(new_measure)
-        
-        return trombone_part
     
-    def _get_original_title(self):
-        """Extract the original title from the input filename."""
+    @functools.cached_property
+    def _original_title(self):
+        """The original title, taken from the input filename."""
         # Use the filename without extension as the title
-        base_name = os.path.splitext(os.path.basename(self.input_file))[0]
-        return base_name
+        return os.path.splitext(os.path.basename(self.input_file))[0]
     
     def _create_score_with_metadata(self, title_suffix):
         """Create a new score with properly configured metadata."""
         score = stream.Score()
-        original_title = self._get_original_title()
+        original_title = self._original_title
         full_title = f"{original_title} - {title_suffix}"
         
         # Create clean metadata without default Music21 composer
-        from music21 import metadata
         score.metadata = metadata.Metadata()
         score.metadata.title = full_title
         score.metadata.movementName = full_title
@@ -597,47 +856,70 @@ class BrassArranger:
         
         return score
     
-    def create_brass_duet_score(self):
-        """Create a combined score with both trumpet and trombone parts."""
+    def create_brass_duet_score(self, trumpet_part=None, trombone_part=None):
+        """Create a combined score with both trumpet and trombone parts.
+
+        Already arranged parts can be passed in; missing ones are arranged here.
+        """
         duet_score = self._create_score_with_metadata("Brass Duet Arrangement")
         
         # Add both instrument parts
-        trumpet_part = self.arrange_for_trumpet()
-        trombone_part = self.arrange_for_trombone()
+        if trumpet_part is None:
+            trumpet_part = self.arrange_for_trumpet()
+        if trombone_part is None:
+            trombone_part = self.arrange_for_trombone()
         
         duet_score.insert(0, trumpet_part)
         duet_score.insert(0, trombone_part)
         
         return duet_score
     
-    def generate_outputs(self, output_dir="./generated"):
-        """Generate all output files (individual parts and duet score)."""
-        base_name = os.path.splitext(os.path.basename(self.input_file))[0]
+    def _export_solo(self, title_suffix, arrange):
+        """Arrange one instrument into its own score and export it."""
+        score = self._create_score_with_metadata(title_suffix)
+        score.insert(0, arrange())
+        return ExportedScore(score, in_place=True)  # Nothing else holds this score
+    
+    def generate_outputs(self, output_dir="./generated", compress=False):
+        """Generate all output files (individual parts and duet score).
+
+        With ``compress`` the files are written as compressed .mxl archives.
+        """
+        base_name = self._original_title
         
         # Ensure output directory exists
         os.makedirs(output_dir, exist_ok=True)
         
-        # Create individual instrument scores
-        trumpet_score = self._create_score_with_metadata("Trumpet")
-        trumpet_score.insert(0, self.arrange_for_trumpet())
-        
-        trombone_score = self._create_score_with_metadata("Trombone")
-        trombone_score.insert(0, self.arrange_for_trombone())
-        
-        # Create combined duet score
-        duet_score = self.create_brass_duet_score()
-        
         # Generate file paths
+        extension = ".mxl" if compress else ".xml"
         output_files = {
-            'trumpet': os.path.join(output_dir, f"{base_name}_Trumpet.xml"),
-            'trombone': os.path.join(output_dir, f"{base_name}_Trombone.xml"),
-            'duet': os.path.join(output_dir, f"{base_name}_BrassDuet.xml")
+            'trumpet': os.path.join(output_dir, f"{base_name}_Trumpet{extension}"),
+            'trombone': os.path.join(output_dir, f"{base_name}_Trombone{extension}"),
+            'duet': os.path.join(output_dir, f"{base_name}_BrassDuet{extension}")
         }
+        duet_title = f"{base_name} - Brass Duet Arrangement"
         
-        # Write files
-        trumpet_score.write('musicxml', fp=output_files['trumpet'])
-        trombone_score.write('musicxml', fp=output_files['trombone'])
-        duet_score.write('musicxml', fp=output_files['duet'])
+        # Load the input up front so worker threads only read shared state
+        self._treble_and_bass
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            # Arrange and export each part once; the duet reuses the serialized solo parts
+            trumpet_future = executor.submit(self._export_solo, "Trumpet", self.arrange_for_trumpet)
+            trombone_future = executor.submit(self._export_solo, "Trombone", self.arrange_for_trombone)
+            trumpet_xml = trumpet_future.result()
+            trombone_xml = trombone_future.result()
+            
+            # Write files
+            writes = [
+                executor.submit(write_musicxml, output_files['trumpet'], [trumpet_xml],
+                                compress=compress),
+                executor.submit(write_musicxml, output_files['trombone'], [trombone_xml],
+                                compress=compress),
+                executor.submit(write_musicxml, output_files['duet'], [trumpet_xml, trombone_xml],
+                                title=duet_title, compress=compress)
+            ]
+            for future in writes:
+                future.result()  # Re-raise any write error
         
         return output_files['trumpet'], output_files['trombone'], output_files['duet']
 
@@ -646,21 +928,21 @@ def main():
     """Main function to run the brass arranger."""
     # Check for both XML and MP3 files, prioritize MP3 to test audio transcription
     input_files = ["Example.mp3", "Example.xml"]
-    input_file = None
     
-    for file in input_files:
-        if os.path.exists(file):
-            input_file = file
-            break
+    # List the working directory once rather than probing each candidate
+    with os.scandir(".") as entries:
+        present = {entry.name for entry in entries if entry.is_file()}
+    input_file = next((file for file in input_files if file in present), None)
     
     if input_file is None:
         print("Error: No input file found. Looking for Example.xml or Example.mp3")
         return
     
-    file_type = "audio" if input_file.endswith('.mp3') else "MusicXML"
+    # Construction is lazy; the arranger already knows the input type from its extension
+    arranger = BrassArranger(input_file)
+    file_type = "audio" if arranger.is_audio_file else "MusicXML"
     print(f"Processing {file_type} file: {input_file}")
     
-    arranger = BrassArranger(input_file)
     trumpet_file, trombone_file, duet_file = arranger.generate_outputs()
     
     print("Brass arrangement complete!")
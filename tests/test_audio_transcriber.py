@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the AudioTranscriber class.
+
+Run with: python -m pytest tests/
+"""
+
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+
+from transcriber.brass_arranger import AudioTranscriber, _load_audio
+
+# The FFTW path of the onset spectra is only used, and tested, when pyfftw is installed
+HAVE_PYFFTW = importlib.util.find_spec("pyfftw") is not None
+
+
+class TestAudioTranscriber(unittest.TestCase):
+    """Test cases for AudioTranscriber analysis helpers."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.transcriber = AudioTranscriber()
+        self.sr = 22050
+        t = np.arange(self.sr) / self.sr
+        self.audio = np.sin(2 * np.pi * 440.0 * t).astype(np.float32)
+
+    def test_detect_onsets_matches_librosa(self):
+        """Test that onsets from the cached mel filterbank match librosa's own detection."""
+        import librosa
+
+        # Three tone bursts separated by silence
+        audio = np.zeros(2 * self.sr, dtype=np.float32)
+        for start in (0.2, 0.8, 1.4):
+            begin = int(start * self.sr)
+            audio[begin:begin + self.sr // 4] = self.audio[:self.sr // 4]
+
+        expected = librosa.onset.onset_detect(y=audio, sr=self.sr, hop_length=512, units='time', backtrack=True)
+        np.testing.assert_array_equal(self.transcriber._detect_onsets(audio, self.sr), expected)
+        self.assertGreater(len(expected), 0)
+
+    def test_onset_spectra_match_full_fft(self):
+        """Test that batched onset spectra match a full FFT of each window."""
+        onset_times = [0.0, 0.3, 0.9, 1.5]  # The last window starts past the end
+        spectra = self.transcriber._onset_spectra(self.audio, self.sr, onset_times)
+
+        self.assertIsNone(spectra[-1])
+        for onset_time, (freqs, mags, _, _) in zip(onset_times, spectra[:-1]):
+            start_time = max(0, onset_time - 0.05)
+            end_time = min(len(self.audio) / self.sr, start_time + 0.3)
+            window = self.audio[int(start_time * self.sr):int(end_time * self.sr)]
+
+            self.assertEqual(mags.dtype, np.float32)  # scipy.fft keeps single precision
+            expected = np.abs(np.fft.fft(window))[:len(window)//2]
+            np.testing.assert_allclose(mags, expected, rtol=1e-4, atol=1e-3)
+            np.testing.assert_allclose(freqs, np.fft.fftfreq(len(window), 1/self.sr)[:len(window)//2])
+
+    def test_batched_peaks_match_per_window_peak_pick(self):
+        """Test that peaks picked for all windows at once match picking each window alone."""
+        import librosa
+
+        rng = np.random.default_rng(0)
+        audio = (self.audio + 0.5 * rng.standard_normal(len(self.audio))).astype(np.float32)
+        spectra = self.transcriber._onset_spectra(audio, self.sr, [0.1, 0.4, 0.7])
+
+        for _, mags, _, peaks in spectra:
+            expected = librosa.util.peak_pick(mags, pre_max=10, post_max=10, pre_avg=5, post_avg=5,
+                                              delta=0.1, wait=5)
+            np.testing.assert_array_equal(peaks, expected)
+
+    def test_frequency_bins_match_frequency_to_note(self):
+        """Test that the per-bin MIDI table agrees with _frequency_to_note."""
+        freqs = np.fft.rfftfreq(6615, 1/self.sr)[:6615//2]
+        bin_midi = self.transcriber._frequency_bins_to_midi(freqs)
+
+        for freq, midi_note in zip(freqs, bin_midi):
+            note_obj = self.transcriber._frequency_to_note(freq)
+            self.assertEqual(midi_note, note_obj.pitch.midi if note_obj else -1)
+
+    def test_midi_spelling_table(self):
+        """Test that notes built from the MIDI table spell like music21's MIDI pitches."""
+        from music21 import pitch
+        from transcriber.brass_arranger import _MIDI_ALTER
+        from transcriber._fast_musicxml import make_pitch
+
+        for midi in range(128):
+            expected = pitch.Pitch(midi=midi)
+            self.assertEqual(make_pitch(midi, _MIDI_ALTER[midi]).nameWithOctave, expected.nameWithOctave)
+
+    def test_single_fft_per_window_length(self):
+        """Test that note extraction never re-transforms audio beyond one batched FFT."""
+        from transcriber import brass_arranger
+
+        onset_times = np.array([0.1, 0.4, 0.7])
+        with patch.object(self.transcriber, '_detect_onsets', return_value=onset_times), \
+                patch.object(brass_arranger, '_rfft', wraps=brass_arranger._rfft) as rfft:
+            self.transcriber._extract_notes_from_audio(self.audio, self.sr)
+
+        self.assertEqual(rfft.call_count, 1)
+        self.assertEqual(rfft.call_args[0][0].shape[0], len(onset_times))
+
+    @unittest.skipUnless(HAVE_PYFFTW, "pyfftw not installed")
+    def test_fftw_rfft_matches_numpy(self):
+        """Test that cached FFTW plans give numpy's spectra, also when called from several threads."""
+        from concurrent.futures import ThreadPoolExecutor
+        from transcriber import brass_arranger
+
+        rng = np.random.default_rng(0)
+        batches = [rng.standard_normal((32, 2048)).astype(np.float32) for _ in range(8)]
+        expected = [np.fft.rfft(frames, axis=1) for frames in batches]
+
+        # A later call with the same shape reuses the plan without overwriting earlier results
+        first = brass_arranger._rfft(batches[0], axis=1)
+        second = brass_arranger._rfft(batches[1], axis=1)
+        np.testing.assert_allclose(first, expected[0], rtol=1e-4, atol=1e-3)
+        np.testing.assert_allclose(second, expected[1], rtol=1e-4, atol=1e-3)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda frames: brass_arranger._rfft(frames, axis=1), batches * 16))
+        for result, spectrum in zip(results, expected * 16):
+            np.testing.assert_allclose(result, spectrum, rtol=1e-4, atol=1e-3)
+
+    def test_extract_notes_split_at_middle_c(self):
+        """Test that detected notes are split into treble and bass by pitch."""
+        t = np.arange(self.sr) / self.sr
+        audio = (self.audio + np.sin(2 * np.pi * 110.0 * t)).astype(np.float32)
+
+        with patch.object(self.transcriber, '_detect_onsets', return_value=np.array([0.1, 0.5])):
+            treble_notes, bass_notes = self.transcriber._extract_notes_from_audio(audio, self.sr)
+
+        self.assertEqual([(onset, n.nameWithOctave) for onset, n in treble_notes], [(0.1, 'A4'), (0.5, 'A4')])
+        self.assertEqual([(onset, n.nameWithOctave) for onset, n in bass_notes], [(0.1, 'A2'), (0.5, 'A2')])
+
+    def test_detect_key_signature(self):
+        """Test that the most frequent pitch class picks the key, the earliest one on ties."""
+        from music21 import note
+
+        def notes(*names):
+            return [(i * 0.5, note.Note(name)) for i, name in enumerate(names)]
+
+        self.assertEqual(self.transcriber._detect_key_signature([]).sharps, 0)
+        self.assertEqual(self.transcriber._detect_key_signature(notes('C4', 'D4', 'D5')).sharps, 2)
+        self.assertEqual(self.transcriber._detect_key_signature(notes('B-3', 'F4', 'F3', 'B-4')).sharps, -2)
+        self.assertEqual(self.transcriber._detect_key_signature(notes('C#4', 'A4')).sharps, 7)
+
+    def test_estimate_note_durations(self):
+        """Test that notes are sorted by onset and quantized to the gap before the next onset."""
+        from music21 import note
+
+        notes = [(1.0, note.Note('E4')), (0.0, note.Note('C4')), (0.3, note.Note('D4')), (3.0, note.Note('G4'))]
+        result = self.transcriber._estimate_note_durations(notes)
+
+        self.assertEqual([onset for onset, _ in result], [0.0, 0.3, 1.0, 3.0])
+        self.assertEqual([n.quarterLength for _, n in result], [0.5, 1.0, 4.0, 1.0])
+
+        # Gaps exactly on a boundary take the shorter value
+        notes = [(onset, note.Note('C4')) for onset in (0.0, 0.375, 1.125, 2.625)]
+        result = self.transcriber._estimate_note_durations(notes)
+        self.assertEqual([n.quarterLength for _, n in result], [0.5, 1.0, 2.0, 1.0])
+
+    def test_dynamic_part_note_placement(self):
+        """Test that notes land in the measure and beat of their onset."""
+        from music21 import instrument, note
+
+        notes = [(0.0, note.Note('C4')), (2.5, note.Note('E4')), (9.0, note.Note('G4'))]
+        part = self.transcriber._create_dynamic_part(notes, instrument.Piano(), audio_duration=4.0)
+
+        measures = part.getElementsByClass('Measure')
+        self.assertEqual(len(measures), 2)
+        placed = [(m.number, n.offset, n.name) for m in measures for n in m.notes]
+        # 9.0s is past the end of the audio, so it is clamped into the last measure
+        self.assertEqual(placed, [(1, 0.0, 'C'), (2, 1.0, 'E'), (2, 2.0, 'G')])
+
+    def test_load_audio_cached(self):
+        """Test that decoded audio is reused until the file changes."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            audio_file = os.path.join(temp_dir, "tone.wav")
+            sf.write(audio_file, self.audio, self.sr)
+
+            audio, sr = _load_audio(audio_file, self.sr)
+            self.assertEqual(sr, self.sr)
+            self.assertIs(_load_audio(audio_file, self.sr)[0], audio)
+            self.assertFalse(audio.flags.writeable)
+
+            # A rewritten file is decoded again
+            sf.write(audio_file, self.audio[:self.sr // 2], self.sr)
+            self.assertEqual(len(_load_audio(audio_file, self.sr)[0]), self.sr // 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,76 +11,347 @@ import os
 from unittest.mock import patch, MagicMock
 
 from transcriber import BrassArranger
+from transcriber._fast_musicxml import CACHE_DIR_ENV
+
+
+EXAMPLE_FILE = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "examples", "Example.xml"))
+HAVE_EXAMPLE = os.path.exists(EXAMPLE_FILE)
+
+# Tests that need the example score are skipped, visibly, when it is missing
+requires_example = unittest.skipUnless(HAVE_EXAMPLE, "Example.xml not found")
+
+# Write generated outputs to tmpfs where available (Linux); None means the default temp dir
+TMP_ROOT = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+
+def setUpModule():
+    """Point the MusicXML disk cache at a temporary directory, not the user's cache."""
+    global _cache_dir, _cache_env
+    _cache_dir = tempfile.TemporaryDirectory()
+    _cache_env = patch.dict(os.environ, {CACHE_DIR_ENV: _cache_dir.name})
+    _cache_env.start()
+
+
+def tearDownModule():
+    """Restore the environment and remove the temporary cache."""
+    _cache_env.stop()
+    _cache_dir.cleanup()
+
+
+def _midi_array(part):
+    """MIDI numbers of every note in a part, as one array."""
+    import numpy as np
+    return np.fromiter((n.pitch.midi for n in part.flatten().notes), dtype=np.int16)
 
 
 class TestBrassArranger(unittest.TestCase):
     """Test cases for BrassArranger functionality."""
     
-    def setUp(self):
-        """Set up test fixtures."""
-        self.example_file = os.path.join(
-            os.path.dirname(__file__), 
-            "..", 
-            "examples", 
-            "Example.xml"
-        )
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures shared by every test."""
+        # Parse the example once; arranging and writing outputs leave it unchanged
+        cls.arranger = BrassArranger(EXAMPLE_FILE) if HAVE_EXAMPLE else None
     
+    @requires_example
     def test_initialization(self):
-        """Test BrassArranger initialization."""
-        if os.path.exists(self.example_file):
-            arranger = BrassArranger(self.example_file)
-            self.assertIsNotNone(arranger.score)
-            self.assertIsNotNone(arranger.treble_part)
-            self.assertIsNotNone(arranger.bass_part)
-    
-    def test_title_extraction(self):
-        """Test original title extraction."""
-        if os.path.exists(self.example_file):
-            arranger = BrassArranger(self.example_file)
-            title = arranger._get_original_title()
-            self.assertEqual(title, "Example")
+        """Test BrassArranger initialization and original title extraction."""
+        arranger = self.arranger
+        self.assertIsNotNone(arranger.score)
+        self.assertIsNotNone(arranger.treble_part)
+        self.assertIsNotNone(arranger.bass_part)
+        self.assertEqual(arranger._original_title, "Example")
     
+    @requires_example
+    def test_score_metadata(self):
+        """Test that every output score gets its own clean metadata."""
+        arranger = self.arranger
+        trumpet_score = arranger._create_score_with_metadata("Trumpet")
+        trombone_score = arranger._create_score_with_metadata("Trombone")
+
+        self.assertIsNot(trumpet_score.metadata, trombone_score.metadata)
+        self.assertEqual(trumpet_score.metadata.title, "Example - Trumpet")
+        self.assertEqual(trombone_score.metadata.title, "Example - Trombone")
+        self.assertEqual(trumpet_score.metadata.composer, "")
+
+    @requires_example
     def test_output_generation(self):
         """Test that output files are generated correctly."""
-        if os.path.exists(self.example_file):
-            with tempfile.TemporaryDirectory() as temp_dir:
-                arranger = BrassArranger(self.example_file)
-                trumpet_file, trombone_file, duet_file = arranger.generate_outputs(temp_dir)
-                
-                # Check that files were created
-                self.assertTrue(os.path.exists(trumpet_file))
-                self.assertTrue(os.path.exists(trombone_file))
-                self.assertTrue(os.path.exists(duet_file))
-                
-                # Check file sizes are reasonable (not empty)
-                self.assertGreater(os.path.getsize(trumpet_file), 1000)
-                self.assertGreater(os.path.getsize(trombone_file), 1000)
-                self.assertGreater(os.path.getsize(duet_file), 2000)
+        with tempfile.TemporaryDirectory(dir=TMP_ROOT) as temp_dir:
+            arranger = self.arranger
+            trumpet_file, trombone_file, duet_file = arranger.generate_outputs(temp_dir)
+            
+            # Check that files were created with reasonable sizes (os.stat raises if missing)
+            for path, min_size in ((trumpet_file, 1000), (trombone_file, 1000), (duet_file, 2000)):
+                self.assertGreater(os.stat(path).st_size, min_size)
+            
+            # Check the duet assembled from the solo parts is readable
+            from music21 import converter
+            duet = converter.parse(duet_file)
+            self.assertEqual(len(duet.parts), 2)
+            self.assertEqual(duet.metadata.bestTitle, "Example - Brass Duet Arrangement")
     
-    def test_ranges_constants(self):
-        """Test that range constants are reasonable."""
-        from transcriber.brass_arranger import Ranges
-        
-        # Test that ranges make musical sense
-        self.assertLess(Ranges.TRUMPET_MIN, Ranges.TRUMPET_MAX)
-        self.assertLess(Ranges.TROMBONE_MIN, Ranges.TROMBONE_MAX)
+    @requires_example
+    def test_compressed_output_generation(self):
+        """Test that compressed outputs hold the same scores as the plain files."""
+        import zipfile
+        with tempfile.TemporaryDirectory(dir=TMP_ROOT) as temp_dir:
+            arranger = self.arranger
+            plain_files = arranger.generate_outputs(os.path.join(temp_dir, "plain"))
+            mxl_files = arranger.generate_outputs(os.path.join(temp_dir, "mxl"), compress=True)
+
+            for plain_file, mxl_file in zip(plain_files, mxl_files):
+                self.assertTrue(mxl_file.endswith(".mxl"))
+                with zipfile.ZipFile(mxl_file) as archive:
+                    self.assertEqual(archive.namelist()[0], "mimetype")
+                    inner_name = os.path.basename(mxl_file)[:-len(".mxl")] + ".xml"
+                    self.assertIn(inner_name, archive.read("META-INF/container.xml").decode())
+                    inner_xml = archive.read(inner_name)
+                with open(plain_file, "rb") as f:
+                    # Part ids are random per export, so compare sizes only
+                    self.assertEqual(len(inner_xml), len(f.read()))
+
+            # Check music21 reads the archive back
+            from music21 import converter
+            duet = converter.parse(mxl_files[2])
+            self.assertEqual(len(duet.parts), 2)
+
+    def test_constants(self):
+        """Test that range and transposition constants are reasonable."""
+        from transcriber.brass_arranger import Ranges, Transposition
         
-        # Test that middle C is reasonable
-        self.assertEqual(Ranges.MIDDLE_C, 60)  # MIDI note 60 = Middle C
+        cases = [
+            # Ranges make musical sense
+            ("TRUMPET_MIN < TRUMPET_MAX", Ranges.TRUMPET_MIN < Ranges.TRUMPET_MAX, True),
+            ("TROMBONE_MIN < TROMBONE_MAX", Ranges.TROMBONE_MIN < Ranges.TROMBONE_MAX, True),
+            ("MIDDLE_C", Ranges.MIDDLE_C, 60),  # MIDI note 60 = Middle C
+            # Bb trumpet transposition is a major 2nd = 2 semitones
+            ("BB_TRUMPET.semitones", Transposition.BB_TRUMPET.semitones, 2),
+        ]
+        for name, value, expected in cases:
+            with self.subTest(name):
+                self.assertEqual(value, expected)
     
-    def test_transposition_constants(self):
-        """Test that transposition intervals are correct."""
-        from transcriber.brass_arranger import Transposition
+    def test_transpose_key_signature(self):
+        """Test that key transposition follows the circle of fifths like music21."""
+        from music21 import interval, key
+        from transcriber.brass_arranger import KeySignatures
+
+        for name in ('M2', 'P5', 'P4', 'm3', 'M6', '-M2', 'M9'):
+            transposition = interval.Interval(name)
+            for sharps in range(-7, 8):
+                expected = key.KeySignature(sharps).transpose(transposition).sharps
+                if -7 <= expected <= 7:
+                    result = KeySignatures.transpose_key_signature(key.KeySignature(sharps), transposition)
+                    self.assertEqual(result.sharps, expected)
+
+        # Past seven sharps the enharmonic key is used: G# major becomes Ab major
+        result = KeySignatures.transpose_key_signature(key.KeySignature(6), interval.Interval('M2'))
+        self.assertEqual(result.sharps, -4)
+
+    def test_key_step_alterations(self):
+        """Test that the key signature lookup table matches music21."""
+        from music21 import key
+        from transcriber.brass_arranger import _KEY_STEP_ALTER
+
+        for sharps in range(-7, 8):
+            expected = [0] * 7
+            for altered in key.KeySignature(sharps).alteredPitches:
+                expected['CDEFGAB'.index(altered.step)] = int(altered.alter)
+            self.assertEqual(_KEY_STEP_ALTER[sharps + 7].tolist(), expected)
+
+    @requires_example
+    def test_vectorized_transposition(self):
+        """Test that measure-wide transposition matches music21 pitch transposition."""
+        import numpy as np
+        from music21 import pitch
+        from transcriber.brass_arranger import Ranges, Transposition
+        from transcriber._fast_musicxml import NOTE_DTYPE, FastMeasure, FastPart, make_pitch
+        
+        arranger = self.arranger
+        names = ['C2', 'F#3', 'B-3', 'E4', 'B4', 'C#5', 'E-6', 'G7']
+        notes = np.array(
+            [(i, pitch.Pitch(n).ps, 1.0, pitch.Pitch(n).alter) for i, n in enumerate(names)],
+            dtype=NOTE_DTYPE
+        )
         
-        # Test Bb trumpet transposition (should be major 2nd)
-        interval = Transposition.BB_TRUMPET
-        self.assertEqual(interval.semitones, 2)  # Major 2nd = 2 semitones
+        arranged = arranger._arrange_fast_part(
+            FastPart([FastMeasure(number=1, notes=notes)]),
+            transposition_interval=Transposition.BB_TRUMPET,
+            min_range=Ranges.TRUMPET_MIN,
+            max_range=Ranges.TRUMPET_MAX,
+            key_sharps=2  # D major
+        )
+        fitted = arranged.measures[0]
+        
+        for name, ps, acc, suppress in zip(names, fitted.notes['ps'], fitted.notes['acc'], fitted.suppress):
+            expected = pitch.Pitch(name).transpose(Transposition.BB_TRUMPET)
+            result = make_pitch(ps, acc)
+            self.assertEqual(result.name, expected.name)
+            self.assertGreaterEqual(result.ps, Ranges.TRUMPET_MIN)
+            self.assertLessEqual(result.ps, Ranges.TRUMPET_MAX)
+            # Only the F# and C# of D major are implied by the key signature
+            self.assertEqual(bool(suppress), result.name in ('F#', 'C#'))
     
-    @unittest.skipIf(not os.path.exists(os.path.join(os.path.dirname(__file__), "..", "examples", "Example.xml")), 
-                     "Example.xml not found")
+    def test_split_single_part_by_pitch(self):
+        """Test that a single piano staff is split at middle C, measure by measure."""
+        import numpy as np
+        from transcriber._fast_musicxml import NOTE_DTYPE, FastMeasure, FastPart
+
+        measures = [
+            FastMeasure(number=1, notes=np.array([(0, 48, 1, 0), (1, 72, 1, 0), (2, 60, 1, 0)], dtype=NOTE_DTYPE)),
+            FastMeasure(number=2),
+            FastMeasure(number=3, notes=np.array([(0, 59, 2, 0)], dtype=NOTE_DTYPE)),
+        ]
+        arranger = BrassArranger("piano.xml")
+        arranger._parts = [FastPart(measures)]
+
+        self.assertEqual([m.notes['ps'].tolist() for m in arranger.treble_part.measures], [[72, 60], [], []])
+        self.assertEqual([m.notes['ps'].tolist() for m in arranger.bass_part.measures], [[48], [], [59]])
+        self.assertEqual([m.number for m in arranger.bass_part.measures], [1, 2, 3])
+
+    def test_audio_spelling_follows_music21(self):
+        """Test that transposed audio notes are respelled like music21's inferred pitches."""
+        from music21 import key, pitch, stream
+        from transcriber.brass_arranger import AudioTranscriber, Ranges, Transposition
+
+        # Transcribed C#, G# and B- in F major, plus notes the ranges move by octaves
+        midis = [37, 49, 56, 61, 68, 70, 75, 90]
+        transcriber = AudioTranscriber()
+        measure = stream.Measure(number=1)
+        measure.append(key.KeySignature(-1))
+        for midi in midis:
+            measure.append(transcriber._frequency_to_note(440.0 * 2 ** ((midi - 69) / 12)))
+        score = stream.Score([stream.Part([measure])])
+
+        arranger = BrassArranger("take.wav")
+        arranger._score = score
+
+        def expected(midi, transposition, min_pitch, max_pitch, sharps):
+            # The music21 route: transpose the inferred pitch, fit it to range, check the key
+            expected_pitch = pitch.Pitch(midi=midi)
+            if transposition is not None:
+                expected_pitch = expected_pitch.transpose(transposition)
+            while expected_pitch.ps < min_pitch:
+                expected_pitch = expected_pitch.transpose(Transposition.OCTAVE_UP)
+            while expected_pitch.ps > max_pitch:
+                expected_pitch = expected_pitch.transpose(Transposition.OCTAVE_DOWN)
+            implied = any(
+                altered.step == expected_pitch.step and altered.alter == expected_pitch.alter
+                for altered in key.KeySignature(sharps).alteredPitches
+            )
+            return expected_pitch.nameWithOctave, expected_pitch.accidental is not None and implied
+
+        def written(part):
+            return [
+                (n.pitch.nameWithOctave, n.pitch.accidental is not None and n.pitch.accidental.displayStatus is False)
+                for n in part.recurse().notes
+            ]
+
+        self.assertEqual(
+            written(arranger.arrange_for_trumpet()),
+            [expected(m, Transposition.BB_TRUMPET, Ranges.TRUMPET_MIN, Ranges.TRUMPET_MAX, 1)
+             for m in midis if m >= Ranges.MIDDLE_C]
+        )
+        self.assertEqual(
+            written(arranger.arrange_for_trombone()),
+            [expected(m, None, Ranges.TROMBONE_MIN, Ranges.TROMBONE_MAX, -1)
+             for m in midis if m < Ranges.MIDDLE_C]
+        )
+        # C# and G# come out as E- and B- on the trumpet, not D# and A#
+        self.assertEqual([name for name, _ in written(arranger.arrange_for_trumpet())][:2], ['E-4', 'B-4'])
+
+    def test_signatures_from_first_measure(self):
+        """Test that key and time signatures set inside the first measure reach the arranged parts."""
+        import numpy as np
+        from music21 import key, meter
+        from transcriber._fast_musicxml import NOTE_DTYPE, FastMeasure, FastPart
+
+        def staff(ps):
+            return FastPart([
+                FastMeasure(number=1, time_sig=(3, 4), key_sig=-1,
+                            notes=np.array([(0, ps, 3, 0)], dtype=NOTE_DTYPE)),
+                FastMeasure(number=2, notes=np.array([(0, ps, 3, 0)], dtype=NOTE_DTYPE)),
+            ])
+
+        arranger = BrassArranger("piano.xml")
+        arranger._parts = [staff(72), staff(48)]
+
+        for part, sharps in ((arranger.arrange_for_trumpet(), 1), (arranger.arrange_for_trombone(), -1)):
+            first_measure = part.getElementsByClass('Measure')[0]
+            # F major sounds in G major on the Bb trumpet
+            self.assertEqual([k.sharps for k in part.recurse().getElementsByClass(key.KeySignature)], [sharps])
+            self.assertEqual([t.ratioString for t in first_measure.getElementsByClass(meter.TimeSignature)], ['3/4'])
+
+    def test_pickup_keeps_its_length(self):
+        """Test that a pickup and a short last bar are not filled up to the whole bar."""
+        import numpy as np
+        from music21 import converter, musicxml, stream
+        from transcriber._fast_musicxml import NOTE_DTYPE, FastMeasure, FastPart
+
+        def staff(ps):
+            return FastPart([
+                FastMeasure(number=0, time_sig=(3, 4), implicit=True, padding_left=2.0,
+                            notes=np.array([(0, ps, 1, 0)], dtype=NOTE_DTYPE)),
+                FastMeasure(number=1, notes=np.array([(0, ps, 3, 0)], dtype=NOTE_DTYPE)),
+                FastMeasure(number=2, padding_right=1.0,
+                            notes=np.array([(0, ps, 2, 0)], dtype=NOTE_DTYPE)),
+            ])
+
+        arranger = BrassArranger("piano.xml")
+        arranger._parts = [staff(72), staff(48)]
+
+        score = stream.Score([arranger.arrange_for_trumpet()])
+        exported = musicxml.m21ToXml.GeneralObjectExporter(score).parse().decode('utf-8')
+        pickup, full, last = converter.parse(exported, format='musicxml').parts[0].getElementsByClass('Measure')
+
+        self.assertIn('<measure implicit="yes" number="0">', exported)
+        self.assertEqual((pickup.paddingLeft, pickup.duration.quarterLength), (2.0, 1.0))
+        self.assertEqual([n.isNote for n in pickup.notesAndRests], [True])
+        self.assertEqual(full.duration.quarterLength, 3.0)
+        self.assertEqual((last.paddingRight, last.duration.quarterLength), (1.0, 2.0))
+        self.assertEqual([n.isNote for n in last.notesAndRests], [True])
+
+    def test_build_part_repeats(self):
+        """Test that repeat signs and endings survive arrangement and export."""
+        import numpy as np
+        from music21 import bar, instrument, key, musicxml, spanner, stream
+        from transcriber._fast_musicxml import NOTE_DTYPE, FastMeasure, FastPart
+
+        def whole_note():
+            return np.array([(0, 72, 4, 0)], dtype=NOTE_DTYPE)
+
+        source = FastPart([
+            FastMeasure(number=1, time_sig=(4, 4), notes=whole_note(), left_repeat='start'),
+            FastMeasure(number=2, notes=whole_note(), barline='light-heavy', repeat='end', repeat_times=2,
+                        ending='1', ending_stop=True),
+            FastMeasure(number=3, notes=whole_note(), barline='light-heavy', ending='2', ending_stop=True),
+        ])
+        arranger = BrassArranger("piano.xml")
+        part = arranger._build_part(arranger._arrange_fast_part(source), instrument.Trumpet(), key.KeySignature(0))
+
+        first, second, third = part.getElementsByClass(stream.Measure)
+        self.assertIsInstance(first.leftBarline, bar.Repeat)
+        self.assertEqual(first.leftBarline.direction, 'start')
+        self.assertIsInstance(second.rightBarline, bar.Repeat)
+        self.assertEqual((second.rightBarline.type, second.rightBarline.direction, second.rightBarline.times),
+                         ('final', 'end', 2))
+        self.assertNotIsInstance(third.rightBarline, bar.Repeat)
+        brackets = part.spannerBundle.getByClass(spanner.RepeatBracket)
+        self.assertEqual([(b.number, b.getSpannedElements()) for b in brackets], [('1', [second]), ('2', [third])])
+
+        score = stream.Score()
+        score.insert(0, part)
+        xml = musicxml.m21ToXml.GeneralObjectExporter(score).parse().decode()
+        self.assertIn('<repeat direction="forward" />', xml)
+        self.assertIn('<repeat direction="backward" times="2" />', xml)
+        self.assertIn('<ending number="1" type="start" />', xml)
+        self.assertIn('<ending number="2" type="start" />', xml)
+
+    @requires_example
     def test_full_workflow(self):
         """Test the complete arrangement workflow."""
-        arranger = BrassArranger(self.example_file)
+        arranger = self.arranger
         
         # Test individual arrangements
         trumpet_part = arranger.arrange_for_trumpet()
@@ -89,10 +360,28 @@ class TestBrassArranger(unittest.TestCase):
         self.assertIsNotNone(trumpet_part)
         self.assertIsNotNone(trombone_part)
         
+        # Every arranged note lies within its instrument's range
+        from transcriber.brass_arranger import Ranges
+        trumpet_midi = _midi_array(trumpet_part)
+        trombone_midi = _midi_array(trombone_part)
+        self.assertGreater(len(trumpet_midi), 0)
+        self.assertGreater(len(trombone_midi), 0)
+        self.assertTrue(((trumpet_midi >= Ranges.TRUMPET_MIN) & (trumpet_midi <= Ranges.TRUMPET_MAX)).all())
+        self.assertTrue(((trombone_midi >= Ranges.TROMBONE_MIN) & (trombone_midi <= Ranges.TROMBONE_MAX)).all())
+        
+        # Arrangement data is computed once and shared between calls
+        self.assertIs(arranger._trumpet_data, arranger._trumpet_data)
+        self.assertIsNot(arranger.arrange_for_trumpet(), trumpet_part)
+        
         # Test combined score
         duet_score = arranger.create_brass_duet_score()
         self.assertIsNotNone(duet_score)
         self.assertEqual(len(duet_score.parts), 2)
+        
+        # Already arranged parts are used as given
+        duet_score = arranger.create_brass_duet_score(trumpet_part, trombone_part)
+        self.assertIn(trumpet_part, duet_score.parts)
+        self.assertIn(trombone_part, duet_score.parts)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the fast MusicXML loader.
+
+Run with: python -m pytest tests/
+"""
+
+import unittest
+import tempfile
+import os
+import zipfile
+
+from transcriber._fast_musicxml import (
+    CACHE_DIR_ENV, FastMeasure, default_cache_dir, make_duration, make_pitch, parse_parts,
+    parse_parts_cached, part_from_stream
+)
+
+
+EXAMPLE_FILE = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "examples", "Example.xml"))
+HAVE_EXAMPLE = os.path.exists(EXAMPLE_FILE)
+
+# Tests that need the example score are skipped, visibly, when it is missing
+requires_example = unittest.skipUnless(HAVE_EXAMPLE, "Example.xml not found")
+
+
+def _write_score(directory, measures):
+    """Write a one-part MusicXML file holding the given <measure> elements; return its path."""
+    path = os.path.join(directory, "score.xml")
+    with open(path, "w") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<score-partwise version="4.0">'
+            '<part-list><score-part id="P1"><part-name>Piano</part-name></score-part></part-list>'
+            '<part id="P1">' + "".join(measures) + '</part>'
+            '</score-partwise>'
+        )
+    return path
+
+
+# A whole-note C5 in 4/4 with one division per quarter
+_WHOLE_NOTE = '<note><pitch><step>C</step><octave>5</octave></pitch><duration>4</duration></note>'
+
+
+class TestFastMusicXML(unittest.TestCase):
+    """Test cases for the streaming MusicXML loader."""
+
+    @requires_example
+    def test_parse_example(self):
+        """Test that both piano staves are loaded with their notes and rests."""
+        parts = parse_parts(EXAMPLE_FILE)
+        self.assertEqual(len(parts), 2)
+
+        treble, bass = parts
+        self.assertEqual([m.number for m in treble.measures], [1, 2, 3])
+        self.assertEqual(treble.first_key_signature(), 0)
+        self.assertEqual(treble.measures[0].notes['ps'].tolist(), [72, 74, 76, 79])
+        self.assertEqual(bass.measures[0].notes['ps'].tolist(), [52, 53, 52, 55])
+        self.assertEqual(bass.measures[2].rests['ql'].tolist(), [1.0, 2.0])
+        self.assertEqual(treble.measures[2].barline, 'light-heavy')
+
+    @requires_example
+    def test_parse_cached(self):
+        """Test that parts read back from the disk cache match a fresh parse."""
+        expected = parse_parts(EXAMPLE_FILE)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            parse_parts_cached(EXAMPLE_FILE, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached = parse_parts_cached(EXAMPLE_FILE, cache_dir=cache_dir)
+
+        self.assertEqual(len(cached), len(expected))
+        for cached_part, part in zip(cached, expected):
+            self.assertEqual(len(cached_part.measures), len(part.measures))
+            for cached_measure, measure in zip(cached_part.measures, part.measures):
+                self.assertEqual(cached_measure.number, measure.number)
+                self.assertEqual(cached_measure.time_sig, measure.time_sig)
+                self.assertEqual(cached_measure.key_sig, measure.key_sig)
+                self.assertEqual(cached_measure.barline, measure.barline)
+                self.assertEqual(cached_measure.repeat, measure.repeat)
+                self.assertEqual(cached_measure.ending, measure.ending)
+                self.assertEqual(cached_measure.notes.tolist(), measure.notes.tolist())
+                self.assertEqual(cached_measure.rests.tolist(), measure.rests.tolist())
+
+    def test_cache_dir_override(self):
+        """Test that the cache directory can be set through the environment."""
+        from unittest.mock import patch
+
+        with patch.dict(os.environ, {CACHE_DIR_ENV: "/tmp/custom-cache", "XDG_CACHE_HOME": "/tmp/xdg"}):
+            self.assertEqual(default_cache_dir(), "/tmp/custom-cache")
+        with patch.dict(os.environ, {CACHE_DIR_ENV: "", "XDG_CACHE_HOME": "/tmp/xdg"}):
+            self.assertEqual(default_cache_dir(), os.path.join("/tmp/xdg", "ai-music-transcription"))
+
+    def test_parse_cached_prunes_stale_entries(self):
+        """Test that rewriting a file replaces its cache entry instead of adding another."""
+        with tempfile.TemporaryDirectory() as temp_dir, tempfile.TemporaryDirectory() as cache_dir:
+            path = _write_score(temp_dir, ['<measure number="1"><attributes><divisions>1</divisions>'
+                                           '</attributes>' + _WHOLE_NOTE + '</measure>'])
+            other = os.path.join(temp_dir, "other.xml")
+            with open(path) as src, open(other, "w") as dst:
+                dst.write(src.read())
+            parse_parts_cached(other, cache_dir=cache_dir)
+            parse_parts_cached(path, cache_dir=cache_dir)
+            # An entry left by the old single-hash naming is never read again
+            legacy = os.path.join(cache_dir, "0" * 40 + ".npz")
+            open(legacy, "wb").close()
+            entries = set(os.listdir(cache_dir))
+            self.assertEqual(len(entries), 3)
+
+            # Same contents, new mtime: the old entry for this file goes, the other file's stays
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            parse_parts_cached(path, cache_dir=cache_dir)
+            new_entries = set(os.listdir(cache_dir))
+
+        self.assertEqual(len(new_entries), 2)
+        self.assertNotIn(os.path.basename(legacy), new_entries)
+        self.assertEqual(len(entries & new_entries), 1)  # The other file's entry
+
+    @requires_example
+    def test_parse_compressed(self):
+        """Test that a compressed .mxl archive parses like the plain file."""
+        expected = parse_parts(EXAMPLE_FILE)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mxl_file = os.path.join(temp_dir, "Example.mxl")
+            with zipfile.ZipFile(mxl_file, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(
+                    "META-INF/container.xml",
+                    '<container><rootfiles><rootfile full-path="score/Example.xml"/></rootfiles></container>'
+                )
+                archive.write(EXAMPLE_FILE, "score/Example.xml")
+            parts = parse_parts(mxl_file)
+
+        self.assertEqual(len(parts), len(expected))
+        for part, expected_part in zip(parts, expected):
+            for measure, expected_measure in zip(part.measures, expected_part.measures):
+                self.assertEqual(measure.notes.tolist(), expected_measure.notes.tolist())
+                self.assertEqual(measure.rests.tolist(), expected_measure.rests.tolist())
+
+    def test_parse_repeats_and_endings(self):
+        """Test that repeat signs and endings are kept, not flattened to plain barlines."""
+        measures = [
+            '<measure number="1"><attributes><divisions>1</divisions></attributes>'
+            '<barline location="left"><bar-style>heavy-light</bar-style><repeat direction="forward"/></barline>'
+            + _WHOLE_NOTE + '</measure>',
+            '<measure number="2"><barline location="left"><ending number="1" type="start"/></barline>'
+            + _WHOLE_NOTE +
+            '<barline location="right"><bar-style>light-heavy</bar-style>'
+            '<ending number="1" type="stop"/><repeat direction="backward" times="3"/></barline></measure>',
+            '<measure number="3"><barline location="left"><ending number="2" type="start">2.</ending></barline>'
+            + _WHOLE_NOTE +
+            '<barline location="right"><ending number="2" type="discontinue"/></barline></measure>',
+            '<measure number="4">' + _WHOLE_NOTE + '<barline><repeat direction="backward"/></barline></measure>',
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = _write_score(temp_dir, measures)
+            first, second, third, fourth = parse_parts(path)[0].measures
+            with tempfile.TemporaryDirectory() as cache_dir:
+                parse_parts_cached(path, cache_dir=cache_dir)
+                cached = parse_parts_cached(path, cache_dir=cache_dir)[0].measures
+
+        self.assertEqual((first.left_barline, first.left_repeat), ('heavy-light', 'start'))
+        self.assertIsNone(first.barline)
+        self.assertEqual((second.barline, second.repeat, second.repeat_times), ('light-heavy', 'end', 3))
+        self.assertEqual((second.ending, second.ending_stop), ('1', True))
+        self.assertIsNone(second.left_barline)  # A plain left barline only carries the ending
+        self.assertEqual((third.barline, third.repeat, third.ending, third.ending_stop), ('regular', None, '2', True))
+        # A repeat without a bar-style keeps music21's default look
+        self.assertEqual((fourth.barline, fourth.repeat), (None, 'end'))
+
+        for cached_measure, measure in zip(cached, (first, second, third, fourth)):
+            for name in ('barline', 'repeat', 'repeat_times', 'left_barline', 'left_repeat', 'ending', 'ending_stop'):
+                self.assertEqual(getattr(cached_measure, name), getattr(measure, name))
+
+    def test_parse_measure_number_suffixes(self):
+        """Test that suffixed measure numbers such as '4a' parse like music21 instead of renumbering."""
+        from music21 import converter
+
+        numbers = ['1', '2', '2a', '3', 'X1', 'X2', '4', '']
+        measures = [
+            '<measure number="%s">' % number
+            + ('<attributes><divisions>1</divisions></attributes>' if index == 0 else '')
+            + _WHOLE_NOTE + '</measure>'
+            for index, number in enumerate(numbers)
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = _write_score(temp_dir, measures)
+            fast_measures = parse_parts(path)[0].measures
+            expected = converter.parse(path).parts[0].getElementsByClass('Measure')
+            with tempfile.TemporaryDirectory() as cache_dir:
+                parse_parts_cached(path, cache_dir=cache_dir)
+                cached = parse_parts_cached(path, cache_dir=cache_dir)[0].measures
+
+        self.assertEqual(
+            [(m.number, m.number_suffix) for m in fast_measures[:-1]],
+            [(m.number, m.numberSuffix) for m in expected][:-1]
+        )
+        self.assertEqual([(m.number, m.number_suffix) for m in fast_measures[:4]],
+                         [(1, None), (2, None), (2, 'a'), (3, None)])
+        # An unnumbered measure continues the count
+        self.assertEqual((fast_measures[-1].number, fast_measures[-1].number_suffix), (5, None))
+        self.assertEqual([(m.number, m.number_suffix) for m in cached],
+                         [(m.number, m.number_suffix) for m in fast_measures])
+
+    def test_parse_forward_as_rest(self):
+        """Test that a <forward> skip in the kept voice becomes a rest, and other voices' skips are dropped."""
+        measures = [
+            # Only a skip, as Finale writes empty measures
+            '<measure number="1"><attributes><divisions>2</divisions></attributes>'
+            '<forward><duration>8</duration><voice>1</voice></forward></measure>',
+            # A skip between notes of the kept voice, then a second voice that only skips
+            '<measure number="2">'
+            '<note><pitch><step>C</step><octave>5</octave></pitch><duration>2</duration><voice>1</voice></note>'
+            '<forward><duration>4</duration><voice>1</voice></forward>'
+            '<note><pitch><step>D</step><octave>5</octave></pitch><duration>2</duration><voice>1</voice></note>'
+            '<backup><duration>8</duration></backup>'
+            '<forward><duration>8</duration><voice>2</voice></forward></measure>',
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first, second = parse_parts(_write_score(temp_dir, measures))[0].measures
+
+        self.assertEqual(first.notes.tolist(), [])
+        self.assertEqual(first.rests.tolist(), [(0.0, 4.0)])
+        self.assertEqual(second.notes['offset'].tolist(), [0.0, 3.0])
+        self.assertEqual(second.rests.tolist(), [(1.0, 2.0)])
+
+    def test_parse_pickup_and_short_measures(self):
+        """Test that pickups are padded on the left and short bars on the right, as music21 reads them."""
+        quarter = '<note><pitch><step>C</step><octave>5</octave></pitch><duration>1</duration><voice>1</voice></note>'
+        measures = [
+            '<measure number="0" implicit="yes"><attributes><divisions>1</divisions>'
+            '<time><beats>3</beats><beat-type>4</beat-type></time></attributes>' + quarter + '</measure>',
+            '<measure number="1">' + quarter * 3 + '</measure>',
+            # A short bar closed by a trailing skip, as Finale writes them
+            '<measure number="2">' + quarter * 2
+            + '<forward><duration>1</duration><voice>1</voice></forward></measure>',
+            # The pickup back into the repeat that completes it
+            '<measure number="3">' + quarter + '</measure>',
+            '<measure number="4">' + quarter * 3 + '</measure>',
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            parsed = parse_parts(_write_score(temp_dir, measures))[0].measures
+
+        self.assertEqual([m.implicit for m in parsed], [True, False, False, False, False])
+        self.assertEqual([m.padding_left for m in parsed], [2.0, 0.0, 0.0, 2.0, 0.0])
+        self.assertEqual([m.padding_right for m in parsed], [0.0, 0.0, 1.0, 0.0, 0.0])
+        self.assertEqual(parsed[2].rests.tolist(), [])
+
+    def test_parse_signatures_inside_measures(self):
+        """Test that key and time signatures set inside measures are kept where they change."""
+        measures = [
+            '<measure number="1"><attributes><divisions>1</divisions><key><fifths>-1</fifths></key>'
+            '<time><beats>3</beats><beat-type>4</beat-type></time></attributes>'
+            '<note><pitch><step>C</step><octave>5</octave></pitch><duration>3</duration></note></measure>',
+            '<measure number="2"><note><pitch><step>C</step><octave>5</octave></pitch><duration>3</duration></note></measure>',
+            '<measure number="3"><attributes><key><fifths>2</fifths></key></attributes>'
+            '<note><pitch><step>C</step><octave>5</octave></pitch><duration>3</duration></note></measure>',
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            part = parse_parts(_write_score(temp_dir, measures))[0]
+
+        self.assertEqual([m.key_sig for m in part.measures], [-1, None, 2])
+        self.assertEqual([m.time_sig for m in part.measures], [(3, 4), None, None])
+        self.assertEqual(part.first_key_signature(), -1)
+
+    def test_part_from_stream_repeats(self):
+        """Test that repeat barlines and endings of a music21 part are read."""
+        from music21 import bar, note, spanner, stream
+
+        measures = [stream.Measure([note.Note('C5', type='whole')], number=n) for n in (1, 2, 3)]
+        measures[0].leftBarline = bar.Repeat(direction='start')
+        measures[1].rightBarline = bar.Repeat(direction='end', times=2)
+        part = stream.Part(measures)
+        part.insert(0, spanner.RepeatBracket(measures[1], number=1))
+        part.insert(0, spanner.RepeatBracket(measures[2], number=2))
+
+        first, second, third = part_from_stream(part).measures
+        self.assertEqual((first.left_barline, first.left_repeat), ('heavy-light', 'start'))
+        self.assertEqual((second.barline, second.repeat, second.repeat_times), ('final', 'end', 2))
+        self.assertEqual([(m.ending, m.ending_stop) for m in (first, second, third)],
+                         [(None, False), ('1', True), ('2', True)])
+
+    def test_part_from_stream_elements(self):
+        """Test that chords keep their first note and unpitched notes become rests."""
+        from music21 import chord, note, stream
+
+        measure = stream.Measure(number=1)
+        measure.append(note.Note('F#4', quarterLength=1.0))
+        measure.append(chord.Chord(['E-4', 'G4'], quarterLength=2.0))
+        measure.append(note.Unpitched(quarterLength=0.5))
+        measure.append(note.Rest(quarterLength=0.5))
+        part = stream.Part([measure])
+
+        fast_measure = part_from_stream(part).measures[0]
+        self.assertEqual(fast_measure.notes.tolist(), [(0.0, 66, 1.0, 1), (1.0, 63, 2.0, -1)])
+        self.assertEqual(fast_measure.rests.tolist(), [(3.0, 0.5), (3.5, 0.5)])
+
+    def test_export_in_place_matches_copy(self):
+        """Test that exporting a throwaway score in place gives the same MusicXML."""
+        from music21 import note, stream
+        from transcriber._fast_musicxml import ExportedScore
+
+        def build():
+            part = stream.Part()
+            for number in (1, 2):
+                measure = stream.Measure(number=number)
+                measure.append([note.Note('C4', quarterLength=1.5), note.Note('E4', quarterLength=0.5)])
+                part.append(measure)
+            score = stream.Score()
+            score.insert(0, part)
+            return score
+
+        copied = ExportedScore(build())
+        in_place = ExportedScore(build(), in_place=True)
+        # Part ids are random per score, so compare everything after the opening tag
+        self.assertEqual([c.split(b'>', 1)[1] for c in in_place.part_chunks],
+                         [c.split(b'>', 1)[1] for c in copied.part_chunks])
+
+    def test_make_pitch_spelling(self):
+        """Test that pitches keep their written spelling."""
+        self.assertEqual(make_pitch(66, 1).nameWithOctave, 'F#4')
+        self.assertEqual(make_pitch(66, -1).nameWithOctave, 'G-4')
+        self.assertEqual(make_pitch(60, 0).nameWithOctave, 'C4')
+        self.assertEqual(make_pitch(59, -1).nameWithOctave, 'C-4')
+
+    def test_make_duration(self):
+        """Test that reused duration components match a freshly built Duration."""
+        from music21 import duration
+
+        for quarter_length in (0.25, 0.75, 1.0, 1.0 / 3, 2.5, 4.0, 1.0):
+            expected = duration.Duration(quarter_length)
+            result = make_duration(quarter_length)
+            self.assertEqual(result.quarterLength, expected.quarterLength)
+            self.assertEqual(result.type, expected.type)
+            self.assertEqual(result.dots, expected.dots)
+            self.assertEqual(len(result.tuplets), len(expected.tuplets))
+            self.assertEqual(result.components, expected.components)
+
+    def test_empty_measure(self):
+        """Test that a bare measure has empty note and rest arrays."""
+        measure = FastMeasure(number=1)
+        self.assertEqual(len(measure.notes), 0)
+        self.assertEqual(len(measure.rests), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
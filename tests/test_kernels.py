@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the note-array kernels.
+
+Run with: python -m pytest tests/
+"""
+
+import unittest
+
+import numpy as np
+
+from transcriber._kernels import (
+    _arrange_notes_loop, _arrange_notes_numpy, _strongest_peaks_loop, _strongest_peaks_numpy
+)
+
+
+class TestKernels(unittest.TestCase):
+    """Test cases for the note-array kernel implementations."""
+
+    def test_numpy_fallback_matches_loop(self):
+        """Test that the vectorized fallback matches the per-note loop."""
+        rng = np.random.default_rng(0)
+        key_alter = np.array([0, 0, 0, 1, 0, 0, 0], dtype=np.int8)  # G major
+        ps = rng.integers(24, 108, 64).astype(np.int16)
+        acc = rng.integers(-1, 2, 64).astype(np.int8)
+
+        results = []
+        for kernel in (_arrange_notes_loop, _arrange_notes_numpy):
+            out_ps, out_acc = ps.copy(), acc.copy()
+            suppress = np.zeros(len(ps), dtype=np.bool_)
+            kernel(out_ps, out_acc, 1, 2, 55, 82, key_alter, suppress)
+            results.append((out_ps, out_acc, suppress))
+
+        for expected, actual in zip(*results):
+            np.testing.assert_array_equal(actual, expected)
+        self.assertTrue(((results[0][0] >= 55) & (results[0][0] <= 82)).all())
+
+    def test_compiled_transposition(self):
+        """Test that the dispatched (Numba-compiled when available) kernel transposes whole arrays."""
+        from transcriber._kernels import arrange_notes
+
+        ps = np.array([60, 62, 64], dtype=np.int16)
+        acc = np.zeros(3, dtype=np.int8)
+        suppress = np.zeros(3, dtype=np.bool_)
+        arrange_notes(ps, acc, 1, 2, 0, 127, np.zeros(7, dtype=np.int8), suppress)  # Up a major 2nd
+
+        self.assertEqual(ps.tolist(), [62, 64, 66])
+        self.assertEqual(acc.tolist(), [0, 0, 1])  # E transposes to F#
+        self.assertEqual(suppress.tolist(), [False, False, False])
+
+    def test_octave_fit_extremes(self):
+        """Test that pitches many octaves out of range land in range in one step."""
+        key_alter = np.zeros(7, dtype=np.int8)
+        for kernel in (_arrange_notes_loop, _arrange_notes_numpy):
+            ps = np.array([0, 11, 40, 77, 120, 127], dtype=np.int16)
+            acc = np.array([0, 0, 0, 0, 0, 0], dtype=np.int8)
+            suppress = np.zeros(len(ps), dtype=np.bool_)
+            kernel(ps, acc, 0, 0, 40, 77, key_alter, suppress)
+            self.assertEqual(ps.tolist(), [48, 47, 40, 77, 72, 67])
+
+    def test_strongest_peaks(self):
+        """Test that both peak selectors keep the strongest usable peaks, strongest first."""
+        mags = np.array([0.0, 0.9, 0.0, 0.04, 0.0, 0.7, 0.0, 1.5, 0.0, 0.3, 0.2], dtype=np.float32)
+        peaks = np.array([1, 3, 5, 7, 9, 10])
+        bin_midi = np.array([-1, 40, -1, 50, -1, 60, -1, -1, -1, 70, 80], dtype=np.int16)
+
+        for kernel in (_strongest_peaks_loop, _strongest_peaks_numpy):
+            # Bin 7 is the loudest but has no note; it still uses up one of the four slots
+            self.assertEqual(kernel(mags, peaks, bin_midi, 4, 0.05).tolist(), [1, 5, 9])
+            self.assertEqual(kernel(mags, peaks[:0], bin_midi, 4, 0.05).tolist(), [])
+
+    def test_strongest_peaks_ties(self):
+        """Test that the partial-selection fallback breaks ties like the loop."""
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            # Few distinct magnitudes, so ties straddle the top-4 cut-off
+            mags = rng.integers(0, 4, 40).astype(np.float32)
+            peaks = np.sort(rng.choice(40, rng.integers(0, 12), replace=False))
+            bin_midi = rng.integers(-1, 2, 40).astype(np.int16)
+
+            np.testing.assert_array_equal(
+                _strongest_peaks_numpy(mags, peaks, bin_midi, 4, 0.5),
+                _strongest_peaks_loop(mags, peaks, bin_midi, 4, 0.5)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()